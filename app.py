@@ -1,54 +1,567 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, g, jsonify, make_response
+from flask import Flask, Blueprint, current_app, render_template, stream_template, request, redirect, url_for, flash, session, g, jsonify, make_response, has_app_context
 from flask_wtf import FlaskForm
 from wtforms import StringField, TextAreaField, SubmitField, FileField, HiddenField
 from wtforms.validators import DataRequired, Optional, Length
-from flask_wtf.csrf import CSRFProtect
-from werkzeug.utils import secure_filename
+from flask_wtf.csrf import CSRFProtect, generate_csrf
+from werkzeug.utils import secure_filename, safe_join
+from werkzeug.local import LocalProxy
+from werkzeug.middleware.proxy_fix import ProxyFix
+from jinja2.environment import TemplateStream
 from datetime import datetime, timedelta
 import sqlite3
+import base64
+import binascii
+import bisect
+import copy
+import gzip
+import hashlib
+import json
+import math
+import queue
+import mimetypes
 import os
 import random
 import sys
-from dateutil.relativedelta import relativedelta
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import click
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask import send_from_directory # Added for serving uploaded files
 
+try:
+    import brotli # Optional: enables 'br' responses and .br static siblings
+except ImportError:
+    brotli = None
+
 
 # --- App Setup ---
-app = Flask(__name__)
+# Apps are built by create_app() at the end of this file. Routes, hooks, template helpers and CLI
+# commands are registered on the `bp` blueprint, and each app starts from DEFAULT_CONFIG.
+bp = Blueprint('board', __name__, cli_group=None) # cli_group=None keeps `flask init-db` etc. top-level
+csrf = CSRFProtect()
+
+DEFAULT_CONFIG = {}
 # IMPORTANT: Replace with a strong, unique, and random key in production!
-app.secret_key = 'your_super_secret_and_unique_key_here_replace_this'
+DEFAULT_CONFIG['SECRET_KEY'] = 'your_super_secret_and_unique_key_here_replace_this'
 
 # --- Session Lifetime ---
-app.permanent_session_lifetime = timedelta(days=365) # Make session last for 1 year (or any duration you want)
+DEFAULT_CONFIG['PERMANENT_SESSION_LIFETIME'] = timedelta(days=365) # Make session last for 1 year (or any duration you want)
+
+# --- Per-app State ---
+# Each app keeps its writer thread, in-memory indexes and rate limiter in app.extensions['anonboard']
+# (see create_app()), and its Socket.IO server in app.extensions['socketio']. These proxies resolve
+# to the current app's instance, so nothing here needs to be handed the app explicitly.
+def app_state(name):
+    return LocalProxy(lambda: current_app.extensions['anonboard'][name])
 
-# Initialize CSRFProtect *after* app.secret_key is set
-csrf = CSRFProtect(app)
-socketio = SocketIO(app)
+socketio = LocalProxy(lambda: current_app.extensions['socketio'])
 
-UPLOAD_FOLDER = os.path.join('static', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'webm', 'ogg'} # Added video extensions
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB max upload size
+DEFAULT_CONFIG['UPLOAD_FOLDER'] = os.path.join('static', 'uploads') # Created on first use, see ensure_initialized()
+DEFAULT_CONFIG['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB max upload size
 
-DATABASE_FILE = 'database.db'
+DEFAULT_CONFIG['DATABASE'] = 'database.db'
+DEFAULT_CONFIG['ARCHIVE_DATABASE'] = 'archive.db' # Cold storage for old posts, see archive_old_posts()
+DEFAULT_CONFIG['SOCKETIO_OPTIONS'] = {} # Keyword arguments for SocketIO(), e.g. async_mode or cors_allowed_origins
+# Statements slower than this are logged together with their EXPLAIN QUERY PLAN
+DEFAULT_CONFIG['SLOW_QUERY_THRESHOLD_MS'] = 100
+
+# --- Metrics (Prometheus text format, served at /metrics) ---
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+class MetricsRegistry:
+    """
+    Minimal thread-safe registry of counters, gauges and histograms.
+    Every sample is keyed by (metric name, sorted label pairs).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}        # name -> (type, help, buckets)
+        self._values = {}      # (name, labels) -> float for counters/gauges
+        self._histograms = {}  # (name, labels) -> [bucket_counts, sum, count]
+
+    def describe(self, name, metric_type, help_text, buckets=None):
+        self._meta[name] = (metric_type, help_text, buckets)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def dec(self, name, value=1, **labels):
+        self.inc(name, -value, **labels)
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = value
+
+    def observe(self, name, value, **labels):
+        buckets = self._meta[name][2] or DEFAULT_BUCKETS
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    hist[0][i] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            values = dict(self._values)
+            histograms = {k: (list(v[0]), v[1], v[2]) for k, v in self._histograms.items()}
+
+        lines = []
+        for name, (metric_type, help_text, buckets) in sorted(self._meta.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == 'histogram':
+                buckets = buckets or DEFAULT_BUCKETS
+                for (hist_name, labels), (counts, total, count) in sorted(histograms.items()):
+                    if hist_name != name:
+                        continue
+                    for bound, bucket_count in zip(buckets, counts):
+                        lines.append(f"{name}_bucket{self._format_labels(labels, [('le', bound)])} {bucket_count}")
+                    lines.append(f"{name}_bucket{self._format_labels(labels, [('le', '+Inf')])} {count}")
+                    lines.append(f"{name}_sum{self._format_labels(labels)} {total}")
+                    lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+            else:
+                for (value_name, labels), value in sorted(values.items()):
+                    if value_name == name:
+                        lines.append(f"{name}{self._format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+metrics.describe('anonboard_http_requests_total', 'counter', 'HTTP requests by endpoint, method and status.')
+metrics.describe('anonboard_http_request_duration_seconds', 'histogram', 'HTTP request latency by endpoint.')
+metrics.describe('anonboard_request_sql_statements', 'histogram', 'SQL statements executed per request.', SQL_COUNT_BUCKETS)
+metrics.describe('anonboard_request_sql_seconds', 'histogram', 'Cumulative SQL time per request.')
+metrics.describe('anonboard_sql_statements_total', 'counter', 'SQL statements executed by verb.')
+metrics.describe('anonboard_sql_seconds_total', 'counter', 'Time spent executing SQL by verb.')
+metrics.describe('anonboard_sql_slow_queries_total', 'counter', 'Statements slower than SLOW_QUERY_THRESHOLD_MS.')
+metrics.describe('anonboard_db_connect_seconds', 'histogram', 'Time taken to open a database connection.')
+metrics.describe('anonboard_db_connection_held_seconds', 'histogram', 'Time a database connection stayed open.')
+metrics.describe('anonboard_db_commit_seconds', 'histogram', 'Time spent in COMMIT, including waiting for the write lock.')
+metrics.describe('anonboard_write_queue_depth', 'gauge', 'Write jobs waiting for the database writer thread.')
+metrics.describe('anonboard_write_batch_size', 'histogram', 'Write jobs committed together in one transaction.', buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+metrics.describe('anonboard_write_jobs_total', 'counter', 'Write jobs by outcome; timeout counts jobs withdrawn before the writer reached them.')
+metrics.describe('anonboard_write_queue_wait_seconds', 'histogram', 'Time write jobs waited in the queue before their transaction started.')
+metrics.describe('anonboard_requests_limited_total', 'counter', 'Write requests refused by endpoint and reason (rate_limited, shed, or new_user_* when an anon_id was not created).')
+metrics.describe('anonboard_posts_archived_total', 'counter', 'Posts moved to the archive database.')
+metrics.describe('anonboard_ranked_index_reloads_total', 'counter', 'Ranked index reloads after other processes wrote to the database.')
+metrics.describe('anonboard_orphans_purged_total', 'counter', 'Orphaned rows deleted by database maintenance, by table.')
+metrics.describe('anonboard_db_reclaimed_bytes_total', 'counter', 'Bytes returned to the filesystem by database maintenance, by source (vacuum or wal).')
+metrics.describe('anonboard_votes_total', 'counter', 'Votes cast by item type and vote type.')
+metrics.describe('anonboard_posts_created_total', 'counter', 'Posts created by kind.')
+metrics.describe('anonboard_comments_created_total', 'counter', 'Comments created.')
+metrics.describe('anonboard_socketio_connections', 'gauge', 'Currently connected Socket.IO clients.')
+metrics.describe('anonboard_socketio_emits_total', 'counter', 'Socket.IO events emitted by event name.')
+
+def sql_verb(sql):
+    """Returns the leading keyword of a statement (SELECT, INSERT, ...) for use as a metric label."""
+    parts = sql.lstrip().split(None, 1)
+    return parts[0].upper() if parts else 'UNKNOWN'
+
+def verb_supports_explain(sql):
+    return sql_verb(sql) in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+class InstrumentedCursor:
+    """Wraps a sqlite3 cursor so every execute() is timed and counted."""
+    def __init__(self, cursor, conn):
+        self._cursor = cursor
+        self._conn = conn
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        try:
+            self._cursor.execute(sql, params)
+        finally:
+            self._conn._record_statement(sql, params, time.perf_counter() - start)
+        return self
 
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+    def executemany(self, sql, seq_of_params):
+        start = time.perf_counter()
+        try:
+            self._cursor.executemany(sql, seq_of_params)
+        finally:
+            self._conn._record_statement(sql, None, time.perf_counter() - start)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class InstrumentedConnection:
+    """
+    Wraps the sqlite3 connection returned by get_db_connection() so that every route
+    reports statement counts, SQL time and slow queries without any per-route code.
+    """
+    def __init__(self, conn, database):
+        self._conn = conn
+        self.database = database # Path of the main database file, e.g. to tell the archive from the hot one
+        self._opened_at = time.perf_counter()
+        self._closed = False
+
+    def cursor(self):
+        return InstrumentedCursor(self._conn.cursor(), self)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            metrics.observe('anonboard_db_commit_seconds', time.perf_counter() - start)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            metrics.observe('anonboard_db_connection_held_seconds', time.perf_counter() - self._opened_at)
+        self._conn.close()
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def _record_statement(self, sql, params, elapsed):
+        verb = sql_verb(sql)
+        metrics.inc('anonboard_sql_statements_total', verb=verb)
+        metrics.inc('anonboard_sql_seconds_total', elapsed, verb=verb)
+        if has_app_context() and 'sql_statements' in g:
+            g.sql_statements += 1
+            g.sql_seconds += elapsed
+        if elapsed * 1000 >= current_app.config['SLOW_QUERY_THRESHOLD_MS']:
+            metrics.inc('anonboard_sql_slow_queries_total', verb=verb)
+            self._log_slow_query(sql, params, elapsed)
+
+    def _log_slow_query(self, sql, params, elapsed):
+        plan = []
+        if verb_supports_explain(sql) and params is not None:
+            try:
+                plan = [row[-1] for row in self._conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+            except sqlite3.Error as e:
+                plan = [f"<EXPLAIN failed: {e}>"]
+        print(f"Slow query ({elapsed * 1000:.1f} ms): {' '.join(sql.split())}", file=sys.stderr)
+        for step in plan:
+            print(f"    plan: {step}", file=sys.stderr)
+
+def emit_event(event, data, **kwargs):
+    """Emits a Socket.IO event and counts it for /metrics."""
+    metrics.inc('anonboard_socketio_emits_total', event=event)
+    socketio.emit(event, data, **kwargs)
+
+@bp.before_app_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0.0
+
+def record_request_metrics(status):
+    if 'request_started' not in g or g.get('request_metrics_recorded'):
+        return
+    g.request_metrics_recorded = True
+    observe_request(g._get_current_object(), request.endpoint or 'unmatched', request.method, status)
+
+def observe_request(state, endpoint, method, status):
+    # state is the request's g, passed explicitly so this also works once the request context is gone
+    metrics.inc('anonboard_http_requests_total', endpoint=endpoint, method=method, status=status)
+    metrics.observe('anonboard_http_request_duration_seconds', time.perf_counter() - state.request_started, endpoint=endpoint)
+    metrics.observe('anonboard_request_sql_statements', state.sql_statements, endpoint=endpoint)
+    metrics.observe('anonboard_request_sql_seconds', state.sql_seconds, endpoint=endpoint)
+
+@bp.after_app_request
+def finish_request_metrics(response):
+    if response.is_streamed and 'request_started' in g:
+        # A stream_template() body is rendered, with the listing SQL it runs, after this hook returns,
+        # so it is recorded once the server closes the response
+        g.request_metrics_recorded = True
+        # Plain values only: a callback holding the response would keep it alive in a reference cycle
+        state, endpoint, method, status = g._get_current_object(), request.endpoint or 'unmatched', request.method, response.status_code
+        response.call_on_close(lambda: observe_request(state, endpoint, method, status))
+    else:
+        record_request_metrics(response.status_code)
+    return response
+
+@bp.teardown_app_request
+def teardown_request_metrics(exc):
+    if exc is not None:
+        record_request_metrics(500)
+
+# --- On-demand Request Profiling ---
+# A request is profiled when it carries `X-Profile: <PROFILE_SECRET>` or is picked by PROFILE_SAMPLE_RATE.
+# 'cprofile' writes a .pstats file; 'stack' runs a low-overhead sampler and writes collapsed stacks (.folded).
+DEFAULT_CONFIG['PROFILE_SECRET'] = os.environ.get('ANONBOARD_PROFILE_SECRET')
+DEFAULT_CONFIG['PROFILE_SAMPLE_RATE'] = 0.0 # Fraction of requests profiled without the header
+DEFAULT_CONFIG['PROFILE_MODE'] = 'cprofile' # 'cprofile' or 'stack'
+DEFAULT_CONFIG['PROFILE_DIR'] = os.path.join('profiles')
+DEFAULT_CONFIG['PROFILE_MAX_FILES'] = 50 # Oldest profiles are deleted beyond this count
+DEFAULT_CONFIG['PROFILE_STACK_INTERVAL'] = 0.005 # Seconds between stack samples
+DEFAULT_CONFIG['ADMIN_TOKEN'] = os.environ.get('ANONBOARD_ADMIN_TOKEN')
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval and counts collapsed stacks."""
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f"{stack} {count}\n")
+
+def should_profile_request():
+    secret = current_app.config['PROFILE_SECRET']
+    if secret and request.headers.get('X-Profile') == secret:
+        return True
+    rate = current_app.config['PROFILE_SAMPLE_RATE']
+    return rate > 0 and random.random() < rate
+
+def trim_profile_dir(profile_dir, max_files):
+    """Keeps the profile directory a bounded ring by deleting the oldest files."""
+    entries = sorted(
+        (os.path.join(profile_dir, name) for name in os.listdir(profile_dir)),
+        key=os.path.getmtime
+    )
+    for path in entries[:max(0, len(entries) - max_files)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+@bp.before_app_request
+def start_request_profiler():
+    if request.endpoint in ('board.list_profiles', 'board.download_profile') or not should_profile_request():
+        return
+    if current_app.config['PROFILE_MODE'] == 'stack':
+        g.profiler = StackSampler(threading.get_ident(), current_app.config['PROFILE_STACK_INTERVAL'])
+        g.profiler.start()
+    else:
+        import cProfile
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def save_request_profile(profiler, endpoint, started, profile_dir, max_files):
+    # Plain arguments only: for a streamed response this runs once the request and app context are gone
+    elapsed_ms = (time.perf_counter() - started) * 1000 if started is not None else 0
+    base_name = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{endpoint}_{elapsed_ms:.0f}ms"
+    try:
+        os.makedirs(profile_dir, exist_ok=True)
+        if isinstance(profiler, StackSampler):
+            profiler.stop()
+            profiler.dump(os.path.join(profile_dir, base_name + '.folded'))
+        else:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(profile_dir, base_name + '.pstats'))
+        trim_profile_dir(profile_dir, max_files)
+    except OSError as e:
+        print(f"Error writing request profile: {e}", file=sys.stderr)
+
+def request_profile_args():
+    return (request.endpoint or 'unmatched', g.get('request_started'),
+            current_app.config['PROFILE_DIR'], current_app.config['PROFILE_MAX_FILES'])
+
+@bp.after_app_request
+def stop_streamed_request_profiler(response):
+    # A stream_template() body, with its SQL, filters and template rendering, is generated after the
+    # request is torn down, so a streamed request's profile is written once the server closes the response
+    if response.is_streamed and 'profiler' in g:
+        profiler, args = g.pop('profiler'), request_profile_args()
+        response.call_on_close(lambda: save_request_profile(profiler, *args))
+    return response
+
+@bp.teardown_app_request
+def stop_request_profiler(exc):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        save_request_profile(profiler, *request_profile_args())
+
+def is_admin_request():
+    token = current_app.config['ADMIN_TOKEN']
+    return bool(token) and request.headers.get('X-Admin-Token') == token
 
 # --- Database Setup ---
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE_FILE)
+def get_db_connection(autocommit=False, database=None, check_same_thread=True):
+    start = time.perf_counter()
+    database = database or current_app.config['DATABASE']
+    # autocommit=True leaves transaction control to the caller (used by the write queue)
+    if autocommit:
+        conn = sqlite3.connect(database, isolation_level=None, check_same_thread=check_same_thread)
+    else:
+        conn = sqlite3.connect(database, check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row  # This makes rows behave like dictionaries
-    return conn
+    # Foreign keys are off by default and per connection; without this CASCADE deletes never fire
+    conn.execute('PRAGMA foreign_keys = ON;')
+    metrics.observe('anonboard_db_connect_seconds', time.perf_counter() - start)
+    return InstrumentedConnection(conn, database)
+
+# --- Anonymous ID Allocation ---
+# Legacy IDs were random draws from 1000-9999. New IDs count up from the anon_id_counter row,
+# which init_db() seeds above every existing ID, so allocation never collides or retries.
+LEGACY_ANON_ID_MAX = 9999
+
+def create_anon_user(conn, join_date):
+    """Write job: creates a user with the next anonymous ID and returns that ID."""
+    anon_id = allocate_anon_id(conn.cursor())
+    conn.execute("INSERT INTO users (anon_id, join_date, total_sigma) VALUES (?, ?, ?)", (anon_id, join_date, 0))
+    return anon_id
+
+def allocate_anon_id(cursor):
+    """
+    Reserves the next anonymous ID inside the caller's transaction and returns it as a string.
+    The UPDATE takes SQLite's write lock, so concurrent allocations are serialized rather than retried.
+    """
+    cursor.execute("UPDATE anon_id_counter SET last_anon_id = last_anon_id + 1 WHERE id = 1 RETURNING last_anon_id")
+    return str(cursor.fetchone()[0])
+
+# Columns copied when a post moves to the archive, listed explicitly so the copy does not depend on column order
+ARCHIVED_TABLE_COLUMNS = {
+    'posts': 'id, username, content, title, image_filename, original_poster_anon_id, sigma, created',
+    'comments': 'id, post_id, commenter_anon_id, content, sigma, created, parent_id, path, depth, reply_count',
+    'votes': 'id, post_id, voter_anon_id, type, created',
+    'comment_votes': 'id, comment_id, voter_anon_id, type, created',
+}
+
+# Reply threading columns, added in place to comments tables created before threading existed.
+# path is the materialized path of the comment (see comment_path); top-level comments have no parent.
+COMMENT_THREAD_COLUMNS = (
+    ('parent_id', 'INTEGER REFERENCES comments (id) ON DELETE CASCADE'),
+    ('path', 'TEXT'),
+    ('depth', 'INTEGER DEFAULT 0'),
+    ('reply_count', 'INTEGER DEFAULT 0'),
+)
+
+def add_comment_thread_columns(conn, schema='main'):
+    """Adds any missing COMMENT_THREAD_COLUMNS to schema.comments and gives pre-threading comments their top-level path."""
+    existing = {row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(comments)")}
+    for name, definition in COMMENT_THREAD_COLUMNS:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {schema}.comments ADD COLUMN {name} {definition}")
+    conn.execute(f"UPDATE {schema}.comments SET path = printf('%010d', id) WHERE path IS NULL")
+
+def create_archive_tables(conn):
+    """
+    Creates the archive schema on a connection with the archive database attached as `archive`.
+    Same tables as the hot database minus users; user references stay plain columns because
+    SQLite foreign keys cannot point into another database.
+    """
+    conn.execute('PRAGMA archive.auto_vacuum = INCREMENTAL;')
+    conn.execute('PRAGMA archive.journal_mode = WAL;')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive.posts (
+            id INTEGER PRIMARY KEY,
+            username TEXT,
+            content TEXT,
+            title TEXT,
+            image_filename TEXT,
+            original_poster_anon_id TEXT NOT NULL,
+            sigma INTEGER DEFAULT 0,
+            created TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive.comments (
+            id INTEGER PRIMARY KEY,
+            post_id INTEGER NOT NULL,
+            commenter_anon_id TEXT NOT NULL,
+            content TEXT NOT NULL,
+            sigma INTEGER DEFAULT 0,
+            created TIMESTAMP,
+            parent_id INTEGER,
+            path TEXT,
+            depth INTEGER DEFAULT 0,
+            reply_count INTEGER DEFAULT 0,
+            FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE,
+            FOREIGN KEY (parent_id) REFERENCES comments (id) ON DELETE CASCADE
+        )
+    ''')
+    add_comment_thread_columns(conn, 'archive')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive.votes (
+            id INTEGER PRIMARY KEY,
+            post_id INTEGER NOT NULL,
+            voter_anon_id TEXT NOT NULL,
+            type TEXT NOT NULL,
+            created TIMESTAMP,
+            UNIQUE(post_id, voter_anon_id),
+            FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive.comment_votes (
+            id INTEGER PRIMARY KEY,
+            comment_id INTEGER NOT NULL,
+            voter_anon_id TEXT NOT NULL,
+            type TEXT NOT NULL,
+            created TIMESTAMP,
+            UNIQUE(comment_id, voter_anon_id),
+            FOREIGN KEY (comment_id) REFERENCES comments (id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_comments_post_created ON comments (post_id, created, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_comments_post_path ON comments (post_id, path, depth)')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_comments_post_top ON comments (post_id, depth, sigma, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_comments_post_depth_created ON comments (post_id, depth, created, id)')
 
 def init_db():
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    # Enable foreign key support for CASCADE deletes
-    cursor.execute('PRAGMA foreign_keys = ON;')
-
+    # Lets run_maintenance() return free pages to the filesystem. Only takes effect while the database
+    # has no tables; older databases are converted with `flask db-maintenance --convert-auto-vacuum`.
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL;')
+    # WAL lets readers keep going while the writer thread commits (persisted in the database file)
+    cursor.execute('PRAGMA journal_mode = WAL;')
     # Users Table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -82,10 +595,16 @@ def init_db():
             content TEXT NOT NULL,
             sigma INTEGER DEFAULT 0,
             created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            parent_id INTEGER, -- Comment this replies to, NULL for top-level comments
+            path TEXT, -- Materialized path, e.g. 0000000012.0000000034 (see comment_path)
+            depth INTEGER DEFAULT 0, -- 0 for top-level comments
+            reply_count INTEGER DEFAULT 0, -- Direct replies
             FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE,
-            FOREIGN KEY (commenter_anon_id) REFERENCES users (anon_id) ON DELETE CASCADE
+            FOREIGN KEY (commenter_anon_id) REFERENCES users (anon_id) ON DELETE CASCADE,
+            FOREIGN KEY (parent_id) REFERENCES comments (id) ON DELETE CASCADE
         )
     ''')
+    add_comment_thread_columns(conn)
 
     # Votes Table (for posts)
     cursor.execute('''
@@ -115,11 +634,728 @@ def init_db():
         )
     ''')
 
+    # Anonymous ID counter (see allocate_anon_id). Seeded once, above the legacy 4-digit IDs and
+    # any existing user, so IDs handed out before this table existed keep their Anon{anon_id} names.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS anon_id_counter (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_anon_id INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO anon_id_counter (id, last_anon_id)
+        SELECT 1, MAX(?, COALESCE(MAX(CAST(anon_id AS INTEGER)), 0)) FROM users
+    ''', (LEGACY_ANON_ID_MAX,))
+
+    # Indexes backing keyset pagination of listings and per-post comment lookups
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_posts_sigma ON posts (sigma DESC, id DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_posts_created ON posts (created DESC, id DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comments_post_created ON comments (post_id, created, id)')
+    # Comment trees and subtrees in thread order, filtered by depth without touching the table
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comments_post_path ON comments (post_id, path, depth)')
+    # Top-level comment pages by sort (see COMMENT_SORTS); DESC orders scan these backwards
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comments_post_top ON comments (post_id, depth, sigma, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comments_post_depth_created ON comments (post_id, depth, created, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_votes_voter ON votes (voter_anon_id, post_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comment_votes_voter ON comment_votes (voter_anon_id, comment_id)')
+
+    # Per-minute net vote counts behind the trending sorts (see TrendingCounters)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vote_buckets (
+            post_id INTEGER NOT NULL,
+            minute INTEGER NOT NULL, -- Unix time // 60
+            delta INTEGER NOT NULL,
+            PRIMARY KEY (post_id, minute)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_vote_buckets_minute ON vote_buckets (minute)')
+
+    # Leaderboard: refills of the all-time board read users by total_sigma; the snapshot holds
+    # each user's sigma gained in the current day/week (see Leaderboard)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_total_sigma ON users (total_sigma DESC, anon_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard_snapshot (
+            period TEXT NOT NULL, -- 'day' or 'week'
+            period_start TEXT NOT NULL,
+            anon_id TEXT NOT NULL,
+            score INTEGER NOT NULL,
+            PRIMARY KEY (period, anon_id)
+        )
+    ''')
+    conn.commit()
+
+    conn.execute('ATTACH DATABASE ? AS archive', (current_app.config['ARCHIVE_DATABASE'],))
+    create_archive_tables(conn)
+    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
     conn.commit()
     conn.close()
 
-# Ensure the database is initialized on startup
-init_db()
+# --- Lazy Startup ---
+# Nothing touches the disk at import. Schema setup runs once per database (`flask init-db`, or the
+# first time a process or CLI command finds PRAGMA user_version behind SCHEMA_VERSION); the rest of
+# the startup work runs before each app's first request, see ensure_initialized().
+SCHEMA_VERSION = 1 # Bump whenever init_db() creates or migrates something new
+
+def ensure_schema():
+    conn = get_db_connection()
+    try:
+        current = conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION
+    finally:
+        conn.close()
+    if not current:
+        init_db()
+
+initialized = app_state('initialized') # threading.Event
+init_lock = app_state('init_lock')
+
+def ensure_initialized():
+    """Creates the upload folder, brings the schema up to date and loads the static asset manifest and in-memory indexes, once."""
+    if initialized.is_set():
+        return
+    with init_lock:
+        if initialized.is_set():
+            return
+        os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+        ensure_schema()
+        build_static_assets()
+        precompress_static_files()
+        load_listing_indexes()
+        load_leaderboard()
+        initialized.set()
+
+# Registered ahead of every other hook that reads the database
+@bp.before_app_request
+def initialize_on_first_request():
+    ensure_initialized()
+
+@bp.cli.command('init-db')
+def init_db_command():
+    """Creates or migrates the database schema ahead of the first start."""
+    init_db()
+    print(f"database schema is at version {SCHEMA_VERSION}")
+
+# --- Database Write Queue ---
+# All writes go through one long-lived connection on a dedicated thread, so requests never
+# compete for SQLite's write lock. Jobs queued while a transaction is running are grouped into
+# the next one (up to WRITE_BATCH_MAX), each inside its own SAVEPOINT so a failing job only
+# rolls back itself. A job is a function taking the writer connection as its first argument;
+# it must not commit and must not touch request state (g, session, flash). An optional on_commit
+# callback receives the job's result on the writer thread right after COMMIT, in commit order,
+# which is where in-memory structures that mirror the database are updated. Jobs submitted with
+# transaction=False (statements SQLite refuses inside a transaction, such as VACUUM) run on their own
+# between batches.
+DEFAULT_CONFIG['WRITE_BATCH_MAX'] = 64
+DEFAULT_CONFIG['WRITE_TIMEOUT'] = 10 # Seconds a request waits for its write before giving up
+
+class DatabaseWriter:
+    def __init__(self, app):
+        self._app = app # The thread runs in this app's context, for its config and in-memory state
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, job, *args, on_commit=None, transaction=True):
+        """Queues job(conn, *args) and returns a Future resolved once its transaction commits."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((job, args, future, on_commit, transaction, time.monotonic()))
+        metrics.set('anonboard_write_queue_depth', self._queue.qsize())
+        return future
+
+    def run(self, job, *args, on_commit=None):
+        """
+        Submits a job and blocks until it has committed, returning its result or raising its exception.
+        After WRITE_TIMEOUT the job is withdrawn if the writer hasn't started it; once started it is
+        waited for, so a caller never reports a failed write that goes on to commit.
+        """
+        future = self.submit(job, *args, on_commit=on_commit)
+        try:
+            return future.result(timeout=current_app.config['WRITE_TIMEOUT'])
+        except FutureTimeoutError:
+            if future.cancel():
+                metrics.inc('anonboard_write_jobs_total', outcome='timeout')
+                raise
+            return future.result()
+
+    def queue_latency(self):
+        """Seconds the oldest queued job has been waiting for the writer thread; 0 when nothing is queued."""
+        with self._queue.mutex:
+            if not self._queue.queue:
+                return 0.0
+            submitted = self._queue.queue[0][-1]
+        return time.monotonic() - submitted
+
+    def _ensure_started(self):
+        # Started on first use rather than at import so that each forked worker gets its own thread
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        with self._app.app_context():
+            self._serve()
+
+    def _serve(self):
+        conn = get_db_connection(autocommit=True)
+        conn.execute('ATTACH DATABASE ? AS archive', (current_app.config['ARCHIVE_DATABASE'],))
+        while True:
+            batch = [self._queue.get()]
+            standalone = None
+            if not batch[0][4]:
+                standalone, batch = batch[0], []
+            while standalone is None and len(batch) < current_app.config['WRITE_BATCH_MAX']:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item[4]:
+                    batch.append(item)
+                else:
+                    standalone = item # Runs once the jobs queued before it have committed
+            metrics.set('anonboard_write_queue_depth', self._queue.qsize())
+            if batch:
+                self._run_batch(conn, batch)
+            if standalone:
+                self._run_standalone(conn, standalone)
+
+    def _run_standalone(self, conn, item):
+        job, args, future, on_commit, _, submitted = item
+        if not future.set_running_or_notify_cancel():
+            return
+        metrics.observe('anonboard_write_queue_wait_seconds', time.monotonic() - submitted)
+        try:
+            result = job(conn, *args)
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            metrics.inc('anonboard_write_jobs_total', outcome='error')
+            future.set_exception(e)
+            return
+        self._finish(future, result, on_commit)
+
+    def _run_batch(self, conn, batch):
+        outcomes = []
+        started = time.monotonic()
+        for *_, submitted in batch:
+            metrics.observe('anonboard_write_queue_wait_seconds', started - submitted)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for job, args, future, on_commit, *_ in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute('SAVEPOINT write_job')
+                try:
+                    result = job(conn, *args)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write_job')
+                    conn.execute('RELEASE write_job')
+                    outcomes.append((future, None, e, None))
+                else:
+                    conn.execute('RELEASE write_job')
+                    outcomes.append((future, result, None, on_commit))
+            start = time.perf_counter()
+            conn.execute('COMMIT')
+            metrics.observe('anonboard_db_commit_seconds', time.perf_counter() - start)
+        except Exception as e:
+            print(f"Write batch of {len(batch)} job(s) failed: {e}", file=sys.stderr)
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            # BEGIN or COMMIT can fail before some jobs have started; those are failed too, never left pending
+            for job, args, future, on_commit, *_ in batch:
+                if future.done() or (not future.running() and not future.set_running_or_notify_cancel()):
+                    continue
+                metrics.inc('anonboard_write_jobs_total', outcome='failed')
+                future.set_exception(e)
+            return
+
+        metrics.observe('anonboard_write_batch_size', len(outcomes))
+        # Futures are only resolved after COMMIT, so callers never see an uncommitted result
+        for future, result, error, on_commit in outcomes:
+            if error is not None:
+                metrics.inc('anonboard_write_jobs_total', outcome='error')
+                future.set_exception(error)
+                continue
+            self._finish(future, result, on_commit)
+
+    def _finish(self, future, result, on_commit):
+        if on_commit is not None:
+            try:
+                on_commit(result)
+            except Exception as e:
+                print(f"on_commit callback {on_commit} failed: {e}", file=sys.stderr)
+        metrics.inc('anonboard_write_jobs_total', outcome='committed')
+        future.set_result(result)
+
+db_writer = app_state('db_writer')
+
+def insert_post(conn, anon_id, title, content, image_filename, created):
+    """Write job: inserts a post by anon_id and returns its id."""
+    cursor = conn.execute('''
+        INSERT INTO posts (username, content, title, image_filename, original_poster_anon_id, sigma, created)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (f"Anon{anon_id}", content, title, image_filename, anon_id, 0, created))
+    return cursor.lastrowid
+
+def insert_comment(conn, post_id, anon_id, content, created, parent_id=None):
+    """Write job: inserts a comment on post_id, as a reply to parent_id if given, and returns its id."""
+    if not conn.execute("SELECT 1 FROM main.posts WHERE id = ?", (post_id,)).fetchone():
+        if conn.execute("SELECT 1 FROM archive.posts WHERE id = ?", (post_id,)).fetchone():
+            raise ValueError("this post is archived and no longer takes comments")
+        raise ValueError("post not found")
+    parent = None
+    if parent_id is not None:
+        parent = conn.execute("SELECT path, depth FROM comments WHERE id = ? AND post_id = ?", (parent_id, post_id)).fetchone()
+        if parent is None:
+            raise ValueError("the comment you replied to no longer exists")
+    cursor = conn.execute('''
+        INSERT INTO comments (post_id, commenter_anon_id, content, created, sigma, parent_id, depth)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (post_id, anon_id, content, created, 0, parent_id, parent['depth'] + 1 if parent else 0))
+    comment_id = cursor.lastrowid
+    # The path ends with the comment's own id, which only exists once the row is inserted
+    conn.execute("UPDATE comments SET path = ? WHERE id = ?", (comment_path(parent['path'] if parent else None, comment_id), comment_id))
+    if parent:
+        conn.execute("UPDATE comments SET reply_count = reply_count + 1 WHERE id = ?", (parent_id,))
+    return comment_id
+
+def delete_post_row(conn, post_id):
+    # Database CASCADE deletes handle comments and votes (get_db_connection turns foreign_keys on)
+    conn.execute("DELETE FROM posts WHERE id = ?", (post_id,))
+
+def delete_comment_row(conn, comment_id):
+    """Write job: deletes a comment together with its replies and returns how many comments were removed."""
+    comment = conn.execute("SELECT post_id, parent_id, path FROM comments WHERE id = ?", (comment_id,)).fetchone()
+    if comment is None:
+        return 0
+    low, high = comment_subtree_range(comment['path'])
+    # Counted up front: replies removed by the parent_id cascade are missing from the DELETE's rowcount
+    removed = conn.execute("SELECT COUNT(*) FROM comments WHERE post_id = ? AND path >= ? AND path < ?",
+                           (comment['post_id'], low, high)).fetchone()[0]
+    conn.execute("DELETE FROM comments WHERE post_id = ? AND path >= ? AND path < ?", (comment['post_id'], low, high))
+    if comment['parent_id'] is not None:
+        conn.execute("UPDATE comments SET reply_count = reply_count - 1 WHERE id = ?", (comment['parent_id'],))
+    return removed
+
+# --- Hot/Cold Archive ---
+# Posts older than ARCHIVE_AFTER_DAYS are moved, with their comments and votes, into archive.db so
+# the hot database and its indexes only hold what the listings read. Listings and search only look
+# at the hot database; post pages fall back to the archive through get_post_connection().
+# Archived posts are read-only.
+DEFAULT_CONFIG['ARCHIVE_AFTER_DAYS'] = 90
+DEFAULT_CONFIG['ARCHIVE_BATCH_SIZE'] = 200 # Posts moved per write transaction
+
+def archive_post_batch(conn, cutoff, batch_size):
+    """Write job: moves up to batch_size posts created before cutoff into the attached archive. Returns the moved ids."""
+    post_ids = [row[0] for row in conn.execute(
+        "SELECT id FROM main.posts WHERE created < ? ORDER BY created, id LIMIT ?", (cutoff, batch_size)
+    ).fetchall()]
+    if not post_ids:
+        return []
+    placeholders = ','.join('?' * len(post_ids))
+
+    def copy(table, where):
+        columns = ARCHIVED_TABLE_COLUMNS[table]
+        conn.execute(f"INSERT INTO archive.{table} ({columns}) SELECT {columns} FROM main.{table} WHERE {where}", post_ids)
+
+    copy('posts', f"id IN ({placeholders})")
+    copy('comments', f"post_id IN ({placeholders})")
+    copy('votes', f"post_id IN ({placeholders})")
+    copy('comment_votes', f"comment_id IN (SELECT id FROM main.comments WHERE post_id IN ({placeholders}))")
+    # CASCADE removes the hot copies of the comments and votes
+    conn.execute(f"DELETE FROM main.posts WHERE id IN ({placeholders})", post_ids)
+    return post_ids
+
+def archive_old_posts(max_age_days=None):
+    """
+    Moves every post older than max_age_days (default ARCHIVE_AFTER_DAYS) to the archive, one batch
+    per write transaction so regular writes are interleaved rather than stalled. Returns the number moved.
+    """
+    if max_age_days is None:
+        max_age_days = current_app.config['ARCHIVE_AFTER_DAYS']
+    cutoff = (datetime.now() - timedelta(days=max_age_days)).strftime("%Y-%m-%d %H:%M:%S")
+    total = 0
+    while True:
+        moved = db_writer.run(archive_post_batch, cutoff, current_app.config['ARCHIVE_BATCH_SIZE'],
+                              on_commit=ranked_index.remove_posts)
+        if not moved:
+            return total
+        total += len(moved)
+        metrics.inc('anonboard_posts_archived_total', len(moved))
+
+def get_post_connection(post_id):
+    """Returns a connection to the database holding post_id: the hot one, else the archive if the post is there."""
+    conn = get_db_connection()
+    if conn.execute("SELECT 1 FROM posts WHERE id = ?", (post_id,)).fetchone() or not os.path.exists(current_app.config['ARCHIVE_DATABASE']):
+        return conn
+    archive_conn = get_db_connection(database=current_app.config['ARCHIVE_DATABASE'])
+    if archive_conn.execute("SELECT 1 FROM posts WHERE id = ?", (post_id,)).fetchone():
+        conn.close()
+        return archive_conn
+    archive_conn.close()
+    return conn
+
+@bp.cli.command('archive-posts')
+@click.option('--days', type=int, default=None, help='Archive posts older than this many days (default: ARCHIVE_AFTER_DAYS).')
+def archive_posts_command(days):
+    """Moves old posts, with their comments and votes, into the archive database."""
+    ensure_schema()
+    print(f"archived {archive_old_posts(days)} post(s)")
+
+# --- Database Maintenance ---
+# Deletes rows left behind by deletes that ran while foreign keys were off, refreshes planner
+# statistics, hands free pages back to the filesystem and truncates the WAL. Every step goes through
+# the writer thread, orphans in bounded batches so regular writes keep flowing. Runs with
+# `flask db-maintenance`, or every MAINTENANCE_INTERVAL_SECONDS in each worker when that is set.
+DEFAULT_CONFIG['MAINTENANCE_INTERVAL_SECONDS'] = 0 # 0 disables the background task
+DEFAULT_CONFIG['MAINTENANCE_BATCH_SIZE'] = 500 # Orphaned rows deleted per write transaction
+DEFAULT_CONFIG['MAINTENANCE_VACUUM_PAGES'] = 10000 # Free pages released per database per run
+
+# Table -> query for the rowids of its orphaned rows, in purge order: deleting comments cascades to
+# their votes, and a reply whose parent is purged becomes an orphan for the next batch
+ORPHAN_QUERIES = {
+    'comments': """SELECT c.rowid FROM comments c
+                   WHERE NOT EXISTS (SELECT 1 FROM posts p WHERE p.id = c.post_id)
+                      OR (c.parent_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM comments r WHERE r.id = c.parent_id))""",
+    'votes': "SELECT v.rowid FROM votes v WHERE NOT EXISTS (SELECT 1 FROM posts p WHERE p.id = v.post_id)",
+    'comment_votes': "SELECT v.rowid FROM comment_votes v WHERE NOT EXISTS (SELECT 1 FROM comments c WHERE c.id = v.comment_id)",
+    'vote_buckets': "SELECT b.rowid FROM vote_buckets b WHERE NOT EXISTS (SELECT 1 FROM posts p WHERE p.id = b.post_id)",
+}
+
+def purge_orphan_batch(conn, table, batch_size):
+    """
+    Write job: deletes up to batch_size orphaned rows from table. Returns (orphans matched, rows deleted,
+    post_id of each deleted comment), where deleted comments include the replies removed by the cascade.
+    """
+    if table != 'comments':
+        cursor = conn.execute(f"DELETE FROM {table} WHERE rowid IN ({ORPHAN_QUERIES[table]} LIMIT ?)", (batch_size,))
+        return cursor.rowcount, cursor.rowcount, []
+    orphans = conn.execute(f"SELECT id, post_id, path FROM comments WHERE rowid IN ({ORPHAN_QUERIES[table]} LIMIT ?)",
+                           (batch_size,)).fetchall()
+    # Collected up front: replies removed by the parent_id cascade are missing from the DELETE's rowcount
+    removed = {} # comment id -> post_id
+    for orphan in orphans:
+        low, high = comment_subtree_range(orphan['path'])
+        for comment_id, post_id in conn.execute("SELECT id, post_id FROM comments WHERE post_id = ? AND path >= ? AND path < ?",
+                                                (orphan['post_id'], low, high)):
+            removed[comment_id] = post_id
+    conn.executemany("DELETE FROM comments WHERE id = ?", [(orphan['id'],) for orphan in orphans])
+    return len(orphans), len(removed), list(removed.values())
+
+def forget_purged_comments(outcome):
+    # Orphaned replies can belong to a live post, whose comment count the ranked index keeps
+    removed = {}
+    for post_id in outcome[2]:
+        removed[post_id] = removed.get(post_id, 0) + 1
+    for post_id, count in removed.items():
+        ranked_index.adjust_comments(post_id, -count)
+
+def purge_orphans(batch_size=None):
+    """Deletes orphaned rows table by table, one batch per write transaction. Returns {table: rows deleted}."""
+    batch_size = batch_size or current_app.config['MAINTENANCE_BATCH_SIZE']
+    purged = {}
+    for table in ORPHAN_QUERIES:
+        purged[table] = 0
+        while True:
+            matched, deleted, _ = db_writer.run(purge_orphan_batch, table, batch_size, on_commit=forget_purged_comments)
+            purged[table] += deleted
+            if matched < batch_size:
+                break
+        metrics.inc('anonboard_orphans_purged_total', purged[table], table=table)
+    return purged
+
+def refresh_statistics(conn):
+    """Write job: gathers planner statistics. A full ANALYZE the first time, then PRAGMA optimize, which only re-analyzes what changed."""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+        conn.execute('ANALYZE')
+    else:
+        conn.execute('PRAGMA optimize')
+
+def database_files():
+    return (('main', current_app.config['DATABASE']), ('archive', current_app.config['ARCHIVE_DATABASE']))
+
+def file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+def reclaim_space(conn, max_pages):
+    """
+    Job run outside a transaction: releases up to max_pages free pages per incremental auto_vacuum
+    database and truncates the WALs. Returns {'vacuum': bytes, 'wal': bytes} given back to the filesystem.
+    """
+    reclaimed = {'vacuum': 0, 'wal': 0}
+    for schema, path in database_files():
+        if conn.execute(f'PRAGMA {schema}.auto_vacuum').fetchone()[0] == 2: # INCREMENTAL
+            # In WAL mode the file only shrinks at the checkpoint below, so count the pages released
+            page_size = conn.execute(f'PRAGMA {schema}.page_size').fetchone()[0]
+            free_before = conn.execute(f'PRAGMA {schema}.freelist_count').fetchone()[0]
+            # incremental_vacuum frees one page per step and returns no rows, so execute() would stop
+            # after the first page; executescript() steps it to completion
+            conn.executescript(f'PRAGMA {schema}.incremental_vacuum({int(max_pages)});')
+            reclaimed['vacuum'] += (free_before - conn.execute(f'PRAGMA {schema}.freelist_count').fetchone()[0]) * page_size
+        wal_before = file_size(path + '-wal')
+        conn.execute(f'PRAGMA {schema}.wal_checkpoint(TRUNCATE)').fetchone()
+        reclaimed['wal'] += max(0, wal_before - file_size(path + '-wal'))
+    return reclaimed
+
+def convert_to_incremental_vacuum(conn):
+    """Job run outside a transaction: switches databases created before auto_vacuum was set, which takes a full VACUUM."""
+    converted = []
+    for schema, _ in database_files():
+        if conn.execute(f'PRAGMA {schema}.auto_vacuum').fetchone()[0] != 2:
+            conn.execute(f'PRAGMA {schema}.auto_vacuum = INCREMENTAL')
+            conn.execute(f'VACUUM {schema}')
+            converted.append(schema)
+    return converted
+
+def run_maintenance():
+    """Runs every maintenance step and returns a report of what was purged and reclaimed."""
+    purged = purge_orphans()
+    db_writer.run(refresh_statistics)
+    reclaimed = db_writer.submit(reclaim_space, current_app.config['MAINTENANCE_VACUUM_PAGES'], transaction=False).result()
+    for source, size in reclaimed.items():
+        metrics.inc('anonboard_db_reclaimed_bytes_total', size, source=source)
+    return {'orphans': purged, 'reclaimed_bytes': reclaimed}
+
+def format_maintenance_report(report):
+    orphans = ', '.join(f"{table}={count}" for table, count in report['orphans'].items())
+    reclaimed = report['reclaimed_bytes']
+    return (f"database maintenance: purged orphans ({orphans}); reclaimed "
+            f"{reclaimed['vacuum']} bytes by vacuum, {reclaimed['wal']} bytes of WAL")
+
+class MaintenanceScheduler:
+    """Runs run_maintenance() every MAINTENANCE_INTERVAL_SECONDS on a daemon thread."""
+    def __init__(self, app):
+        self._app = app
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        # Started from the first request rather than at import so that each forked worker gets its own thread
+        if not self._app.config['MAINTENANCE_INTERVAL_SECONDS'] or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='db-maintenance', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self._app.config['MAINTENANCE_INTERVAL_SECONDS'])
+            try:
+                with self._app.app_context():
+                    print(format_maintenance_report(run_maintenance()))
+            except Exception as e:
+                print(f"Database maintenance failed: {e}", file=sys.stderr)
+
+maintenance = app_state('maintenance')
+
+@bp.before_app_request
+def start_maintenance_scheduler():
+    maintenance.ensure_started()
+
+@bp.cli.command('db-maintenance')
+@click.option('--convert-auto-vacuum', is_flag=True, help='First switch older databases to incremental auto_vacuum (runs a full VACUUM).')
+def db_maintenance_command(convert_auto_vacuum):
+    """Purges orphaned rows, refreshes planner statistics and reclaims free space."""
+    ensure_schema()
+    if convert_auto_vacuum:
+        converted = db_writer.submit(convert_to_incremental_vacuum, transaction=False).result()
+        print(f"converted to incremental auto_vacuum: {', '.join(converted) or 'nothing to convert'}")
+    print(format_maintenance_report(run_maintenance()))
+# --- Static Asset Pipeline ---
+# Shared CSS/JS bundles are copied to static/dist/ under content-hashed names before the first request
+# (or with `flask build-assets`), so they can be served with immutable caching.
+ASSET_SOURCES = (
+    'css/board.css',
+    'css/photos.css',
+    'css/post_detail_common.css',
+    'css/post_detail.css',
+    'css/post_detail_like.css',
+    'js/board.js',
+    'js/post_detail_common.js',
+    'js/post_detail.js',
+    'js/post_detail_like.js',
+)
+ASSET_BUILD_DIR = 'dist'
+asset_manifest = app_state('asset_manifest') # logical path -> hashed path, both relative to the static folder
+
+def build_static_assets():
+    """Writes a content-hashed copy of every asset in ASSET_SOURCES and refreshes the manifest."""
+    manifest = {}
+    for logical_path in ASSET_SOURCES:
+        with open(os.path.join(current_app.static_folder, logical_path), 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        base, ext = os.path.splitext(logical_path)
+        hashed_path = f"{ASSET_BUILD_DIR}/{base}.{digest}{ext}"
+        target = os.path.join(current_app.static_folder, hashed_path)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_target = f"{target}.tmp"
+            with open(tmp_target, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_target, target)
+        manifest[logical_path] = hashed_path
+    asset_manifest.clear()
+    asset_manifest.update(manifest)
+    return manifest
+
+@bp.app_template_global()
+def asset_url(filename):
+    """Like url_for('static', ...) but resolves to the fingerprinted copy when one was built."""
+    return url_for('static', filename=asset_manifest.get(filename, filename))
+
+@bp.after_app_request
+def cache_fingerprinted_assets(response):
+    if request.endpoint == 'static' and (request.view_args or {}).get('filename', '').startswith(ASSET_BUILD_DIR + '/'):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+@bp.cli.command('build-assets')
+def build_assets_command():
+    """Builds the fingerprinted static asset bundles."""
+    for logical_path, hashed_path in build_static_assets().items():
+        print(f"{logical_path} -> {hashed_path}")
+    for path in precompress_static_files():
+        print(f"compressed {path}")
+
+# --- Response Compression ---
+DEFAULT_CONFIG['COMPRESSION_ENABLED'] = True
+DEFAULT_CONFIG['COMPRESSION_MIN_SIZE'] = 1024 # Bytes; smaller buffered bodies are sent as-is
+DEFAULT_CONFIG['COMPRESSION_GZIP_LEVEL'] = 6
+DEFAULT_CONFIG['COMPRESSION_BROTLI_QUALITY'] = 5 # Per-request quality; static siblings always use the maximum
+DEFAULT_CONFIG['COMPRESSION_STREAM_FLUSH_SIZE'] = 8192 # Uncompressed bytes a streamed body buffers between flushes
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+    'application/json', 'image/svg+xml',
+}
+PRECOMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.html')
+STATIC_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+def negotiate_encoding():
+    """Returns 'br', 'gzip' or None according to the request's Accept-Encoding q-values."""
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+def compression_level(encoding):
+    return current_app.config['COMPRESSION_BROTLI_QUALITY' if encoding == 'br' else 'COMPRESSION_GZIP_LEVEL']
+
+def compress_stream(chunks, encoding, level, flush_size):
+    """
+    Compresses a streamed body, flushing whenever flush_size bytes have gone in since the last flush.
+    Flushing after every template chunk would compress each tiny piece on its own and roughly triple the size.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31) # 31 = gzip container
+        compress, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    pending = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compress(chunk)
+            pending += len(chunk)
+            if pending >= flush_size:
+                data += flush()
+                pending = 0
+            if data:
+                yield data
+        yield finish()
+    finally:
+        # Closing the wrapped stream ends its request context now rather than whenever it is garbage collected
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def compress_bytes(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=compression_level(encoding))
+    return gzip.compress(data, compresslevel=compression_level(encoding))
+
+@bp.after_app_request
+def compress_response(response):
+    if (not current_app.config['COMPRESSION_ENABLED']
+            or request.endpoint == 'static' # Served from pre-compressed siblings instead
+            or response.direct_passthrough
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # The settings are read now: the body is generated after the app context has been popped
+        response.response = compress_stream(response.response, encoding, compression_level(encoding),
+                                            current_app.config['COMPRESSION_STREAM_FLUSH_SIZE'])
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config['COMPRESSION_MIN_SIZE']:
+            return response
+        response.set_data(compress_bytes(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def precompress_static_files():
+    """
+    Writes .gz (and .br when brotli is installed) siblings next to compressible static files,
+    skipping uploads and siblings that are already newer than their source. Returns the written paths.
+    """
+    written = []
+    upload_dir = os.path.abspath(current_app.config['UPLOAD_FOLDER'])
+    for root, dirs, files in os.walk(current_app.static_folder):
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) != upload_dir]
+        for name in files:
+            if not name.endswith(PRECOMPRESS_EXTENSIONS):
+                continue
+            source = os.path.join(root, name)
+            source_mtime = os.path.getmtime(source)
+            data = None
+            for encoding, suffix in STATIC_ENCODINGS:
+                if encoding == 'br' and brotli is None:
+                    continue
+                target = source + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= source_mtime:
+                    continue
+                if data is None:
+                    with open(source, 'rb') as f:
+                        data = f.read()
+                compressed = brotli.compress(data, quality=11) if encoding == 'br' else gzip.compress(data, compresslevel=9, mtime=0)
+                with open(target + '.tmp', 'wb') as f:
+                    f.write(compressed)
+                os.replace(target + '.tmp', target)
+                written.append(target)
+    return written
+
+@bp.before_app_request
+def serve_precompressed_static():
+    """Answers static requests from a .br/.gz sibling when the client accepts it."""
+    if request.endpoint != 'static':
+        return None
+    filename = (request.view_args or {}).get('filename', '')
+    if not filename.endswith(PRECOMPRESS_EXTENSIONS):
+        return None
+    encoding = negotiate_encoding()
+    suffix = dict(STATIC_ENCODINGS).get(encoding)
+    if suffix is None:
+        return None
+    sibling = safe_join(current_app.static_folder, filename + suffix)
+    if sibling is None or not os.path.isfile(sibling):
+        return None
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_from_directory(current_app.static_folder, filename + suffix, mimetype=mimetype, max_age=current_app.get_send_file_max_age(filename))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
 
 # --- Utility Functions ---
 def allowed_file(filename):
@@ -148,28 +1384,21 @@ def get_or_create_user_data():
     join_date = datetime.today().strftime("%Y-%m-%d %H:%M:%S") # Default if not found
 
     if not current_anon_id or current_anon_id == "0000": # "0000" acts as a sentinel for invalid/missing anon_id
-        new_anon_id = str(random.randint(1000, 9999))
-        while True: # Ensure generated ID is unique
-            cursor.execute("SELECT 1 FROM users WHERE anon_id = ?", (new_anon_id,))
-            if cursor.fetchone() is None:
-                break
-            new_anon_id = str(random.randint(1000, 9999))
-
         new_join_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         new_total_sigma = 0 # Starting sigma for a brand new user
 
+        if not may_create_anon_user():
+            conn.close()
+            return "0000", "N/A", 0, 0, 0, 0 # Served without an anon_id; the next request tries again
         try:
-            cursor.execute("INSERT INTO users (anon_id, join_date, total_sigma) VALUES (?, ?, ?)",
-                           (new_anon_id, new_join_date, new_total_sigma))
-            conn.commit()
+            new_anon_id = db_writer.run(create_anon_user, new_join_date)
             current_anon_id = new_anon_id
             join_date = new_join_date
             total_sigma = new_total_sigma
-        except sqlite3.IntegrityError:
-            print(f"Error: Generated anon_id {new_anon_id} already exists (collision). Rolling back.", file=sys.stderr)
-            conn.rollback()
+        except Exception as e:
+            print(f"Error creating anonymous user: {e}", file=sys.stderr)
             conn.close()
-            return "0000", "N/A", 0, 0, 0, 0 # Return default if collision
+            return "0000", "N/A", 0, 0, 0, 0 # Return default if the user could not be created
         session["anon_id"] = current_anon_id
     else:
         # User has an anon_id in session, try to fetch from DB
@@ -208,9 +1437,117 @@ def get_or_create_user_data():
 
     return current_anon_id, join_date, total_sigma, threads_created, comments_made, total_likes_received_on_posts
 
+# --- Rate Limiting and Load Shedding ---
+# POSTs to the endpoints in RATE_LIMITS take a token from two buckets: one for the session's anon_id
+# and a larger one for the client IP, which also covers clients that drop their cookie to get a
+# fresh anon_id. Empty buckets get 429 with Retry-After. When writes already queue for longer than
+# WRITE_SHED_LATENCY, write requests are refused with 503 so reads keep being served. Both checks run
+# before the session hook, so refused requests never reach the database. Creating an anon_id is a
+# write on any request without a session cookie, so it has its own per-IP bucket and is skipped
+# while shedding; such requests are served without an anon_id instead of being refused.
+# Behind a reverse proxy, set TRUSTED_PROXIES so request.remote_addr is the client's address taken
+# from X-Forwarded-For (werkzeug's ProxyFix) rather than the proxy's, which every client would share.
+DEFAULT_CONFIG['RATE_LIMIT_ENABLED'] = True
+DEFAULT_CONFIG['RATE_LIMITS'] = {
+    # endpoint: (tokens refilled per second, burst size) for each anon_id
+    'board.handle_vote': (2, 30),
+    'board.add_generic_comment': (0.2, 5),
+    'board.create_post': (0.05, 3),
+    'board.create_thread_post': (0.05, 3),
+    'board.upload_image': (0.05, 3),
+    'board.delete_post': (0.5, 10),
+    'board.delete_comment': (0.5, 10),
+}
+DEFAULT_CONFIG['RATE_LIMIT_IP_MULTIPLIER'] = 5 # An IP gets this many anon_ids' worth of tokens (shared NATs)
+DEFAULT_CONFIG['RATE_LIMIT_NEW_USERS'] = (0.2, 20) # (tokens per second, burst) of anon_ids each client IP may create
+DEFAULT_CONFIG['RATE_LIMIT_MAX_KEYS'] = 100000 # Buckets kept before the least recently used are forgotten
+DEFAULT_CONFIG['WRITE_SHED_LATENCY'] = 2.0 # Seconds the oldest queued write may wait before writes are shed
+DEFAULT_CONFIG['TRUSTED_PROXIES'] = 0 # Reverse proxies in front of the app that append to X-Forwarded-For
+
+class TokenBuckets:
+    """Token buckets in a bounded LRU map. A forgotten bucket comes back full, which only ever errs towards allowing."""
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict() # key -> (tokens, last refill time)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None):
+        """Takes a token from key's bucket. Returns 0 if one was available, else the seconds until one will be."""
+        return self.take_all([(key, rate, burst)], now)
+
+    def take_all(self, buckets, now=None):
+        """
+        Takes a token from every (key, rate, burst) bucket, or from none of them unless all have one, so a
+        refused request doesn't drain the others. Returns 0 if taken, else the seconds until all will have one.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            levels = []
+            for key, rate, burst in buckets:
+                tokens, refilled = self._buckets.pop(key, (burst, now))
+                levels.append(min(burst, tokens + (now - refilled) * rate))
+            wait = max([(1 - tokens) / rate for tokens, (_, rate, _) in zip(levels, buckets) if tokens < 1], default=0)
+            for tokens, (key, _, _) in zip(levels, buckets):
+                self._buckets[key] = (tokens - 1 if wait == 0 else tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+rate_limiter = app_state('rate_limiter')
+
+def limited_response(status, message, retry_after):
+    if request.is_json or request.path.startswith('/api/'):
+        response = jsonify(success=False, message=message)
+    else:
+        response = make_response(message)
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+@bp.before_app_request
+def limit_write_requests():
+    limits = current_app.config['RATE_LIMITS'].get(request.endpoint)
+    if limits is None or request.method != 'POST' or not current_app.config['RATE_LIMIT_ENABLED']:
+        return None
+
+    latency = db_writer.queue_latency()
+    if latency > current_app.config['WRITE_SHED_LATENCY']:
+        metrics.inc('anonboard_requests_limited_total', endpoint=request.endpoint, reason='shed')
+        return limited_response(503, "The server is busy. Please try again shortly.", latency)
+
+    rate, burst = limits
+    multiplier = current_app.config['RATE_LIMIT_IP_MULTIPLIER']
+    buckets = [(('ip', request.endpoint, request.remote_addr), rate * multiplier, burst * multiplier)]
+    anon_id = session.get('anon_id')
+    if anon_id:
+        buckets.append((('anon', request.endpoint, anon_id), rate, burst))
+    wait = rate_limiter.take_all(buckets)
+    if wait:
+        metrics.inc('anonboard_requests_limited_total', endpoint=request.endpoint, reason='rate_limited')
+        return limited_response(429, "You're doing that too often. Please slow down.", wait)
+    return None
+
+def may_create_anon_user():
+    """Whether get_or_create_user_data() may create an anon_id for the current request."""
+    if not current_app.config['RATE_LIMIT_ENABLED']:
+        return True
+    if db_writer.queue_latency() > current_app.config['WRITE_SHED_LATENCY']:
+        metrics.inc('anonboard_requests_limited_total', endpoint=request.endpoint, reason='new_user_shed')
+        return False
+    rate, burst = current_app.config['RATE_LIMIT_NEW_USERS']
+    if rate_limiter.take(('new_user', request.remote_addr), rate, burst):
+        metrics.inc('anonboard_requests_limited_total', endpoint=request.endpoint, reason='new_user_rate_limited')
+        return False
+    return True
+
 # --- Before Request Hook (User Session Management) ---
-@app.before_request
+# Endpoints that must not create anonymous users (e.g. scraped by monitoring)
+SESSIONLESS_ENDPOINTS = {'board.metrics_endpoint', 'board.list_profiles', 'board.download_profile', 'static'}
+
+@bp.before_app_request
 def load_user_into_g():
+    if request.endpoint in SESSIONLESS_ENDPOINTS:
+        return
     g.anon_id, g.join_date, g.sigma_score, g.threads_created, g.comments_made, g.total_likes_received_on_posts = get_or_create_user_data()
 
 # --- Forms (Flask-WTF) ---
@@ -222,6 +1559,7 @@ class PostForm(FlaskForm):
 
 class CommentForm(FlaskForm):
     comment_content = TextAreaField('Your Comment', validators=[DataRequired(), Length(max=500)])
+    parent_id = HiddenField() # Set by the reply form; empty for top-level comments
     submit = SubmitField('Add Comment')
 
 class DeletePostForm(FlaskForm):
@@ -233,12 +1571,14 @@ class DeleteCommentForm(FlaskForm):
     submit = SubmitField('Delete Comment')
 
 # --- Jinja2 Filters ---
-@app.template_filter('format_time_ago')
+@bp.app_template_filter('format_time_ago')
 def format_time_ago_filter(timestamp_str):
     """
     Formats a given timestamp string (e.g., "YYYY-MM-DD HH:MM:SS") into a human-readable
     "time ago" string (e.g., "30 minutes ago", "1 day ago").
     """
+    from dateutil.relativedelta import relativedelta # Only needed once a page renders, not at import
+
     if timestamp_str is None:
         return "Unknown time"
 
@@ -272,53 +1612,918 @@ def format_time_ago_filter(timestamp_str):
             return "Just now"
         return f"{seconds} second{'s' if seconds != 1 else ''} ago"
 
-app.jinja_env.filters['format_time_ago'] = format_time_ago_filter
-
-
-# --- Routes ---
-
-@app.route('/')
-@app.route('/feed')
-def feed():
-    sort = request.args.get("sort", "best")
-    view = request.args.get("view", "card")
-    search_query = request.args.get("q", "").strip()
 
-    # Query to select all posts, including their original poster's anon_id
-    query = "SELECT id, username, content, image_filename, created, sigma, original_poster_anon_id, title FROM posts"
+# --- Listing Queries (shared by the HTML pages and the JSON API) ---
+DEFAULT_CONFIG['LISTING_PAGE_SIZE'] = 20 # Posts rendered per page before infinite scroll takes over
+DEFAULT_CONFIG['API_MAX_PAGE_SIZE'] = 100
+DEFAULT_CONFIG['LISTING_FETCH_CHUNK'] = 10 # Rows read from the cursor at a time while a listing page streams
+DEFAULT_CONFIG['LISTING_STREAM_BUFFER'] = 40 # Template output pieces joined into each streamed chunk (about one post card)
+DEFAULT_CONFIG['RANKED_INDEX_ENABLED'] = True # Serve unsearched listing pages from the in-memory ranked index
+DEFAULT_CONFIG['TRENDING_FLUSH_SECONDS'] = 60 # How often in-memory trending buckets are written to vote_buckets
+DEFAULT_CONFIG['RANKED_INDEX_SYNC_SECONDS'] = 2 # How often listings check for posts changed by other processes
+
+COMMENT_COUNT_SQL = "(SELECT COUNT(*) FROM comments c WHERE c.post_id = p.id)"
+
+LISTING_FILTERS = {
+    'all': None,
+    'photos': "(p.image_filename IS NOT NULL AND p.image_filename != '')",
+    'text': "(p.image_filename IS NULL OR p.image_filename = '')",
+}
+
+# Trending sort keys -> window length in minutes
+TRENDING_WINDOWS = {'trending_hour': 60, 'trending_day': 24 * 60}
+TRENDING_SORTS = {'trending': 'trending_hour', 'trending_day': 'trending_day'}
+
+# Sort name -> sort key for each listing; unknown sort names fall back to each listing's original default
+LISTING_SORTS = {
+    'all': ({'best': 'sigma', 'hottest': 'sigma', 'latest': 'created', **TRENDING_SORTS}, 'created'),
+    'photos': ({'best': 'sigma', 'hottest': 'sigma', 'latest': 'created', **TRENDING_SORTS}, 'sigma'),
+    'text': ({'best': 'comments', 'hottest': 'sigma', 'latest': 'created', **TRENDING_SORTS}, 'created'),
+}
+
+SORT_KEY_EXPRESSIONS = {
+    'sigma': 'p.sigma',
+    'created': 'p.created',
+    'comments': COMMENT_COUNT_SQL,
+}
+
+def sort_key_expression(sort_key):
+    """SQL for a sort key. Trending keys sum the persisted vote_buckets for the window ending now."""
+    if sort_key in TRENDING_WINDOWS:
+        since_minute = current_minute() - TRENDING_WINDOWS[sort_key]
+        return f"(SELECT COALESCE(SUM(b.delta), 0) FROM vote_buckets b WHERE b.post_id = p.id AND b.minute > {since_minute})"
+    return SORT_KEY_EXPRESSIONS[sort_key]
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(sort_value, item_id):
+    """Encodes the last row's (sort value, id) into an opaque URL-safe pagination cursor."""
+    raw = json.dumps([sort_value, item_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, item_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError, binascii.Error):
+        raise InvalidCursor(cursor)
+    # Both values are bound as SQL parameters, which must be scalars (a list or object would be a 500)
+    if not isinstance(item_id, int) or not isinstance(sort_value, (str, int, float, type(None))):
+        raise InvalidCursor(cursor)
+    return sort_value, item_id
+
+def listing_sort_key(kind, sort):
+    sorts, fallback = LISTING_SORTS[kind]
+    return sorts.get(sort, fallback)
+
+def build_listing_query(kind, sort, search_query='', cursor=None, limit=20):
+    """
+    Returns (query, params) for one page of a listing ('all', 'photos' or 'text').
+    Pages are keyset-paginated on (sort key, id) so later pages cost the same as the first.
+    The query asks for limit + 1 rows; the extra row tells the caller whether another page exists.
+    Raises InvalidCursor if the cursor cannot be decoded.
+    """
+    sort_key = listing_sort_key(kind, sort)
+    sort_expr = sort_key_expression(sort_key)
+    query = f"""SELECT p.id, p.username, p.content, p.image_filename, p.created, p.sigma,
+                       p.original_poster_anon_id, p.title, {COMMENT_COUNT_SQL} AS total_comments,
+                       {sort_expr} AS sort_value
+                FROM posts p"""
     filters = []
     params = []
 
+    if LISTING_FILTERS[kind]:
+        filters.append(LISTING_FILTERS[kind])
+
     if search_query:
-        filters.append("(username LIKE ? OR content LIKE ? OR title LIKE ?)")
+        filters.append("(p.username LIKE ? OR p.content LIKE ? OR p.title LIKE ?)")
         params.extend([f'%{search_query}%', f'%{search_query}%', f'%{search_query}%'])
 
+    if cursor:
+        sort_value, last_id = decode_cursor(cursor)
+        filters.append(f"({sort_expr} < ? OR ({sort_expr} = ? AND p.id < ?))")
+        params.extend([sort_value, sort_value, last_id])
+
     if filters:
         query += " WHERE " + " AND ".join(filters)
 
-    if sort == "hottest":
-        query += " ORDER BY sigma DESC"
-    elif sort == "best":
-        query += " ORDER BY sigma DESC" # For feed, 'best' by sigma is usually hottest
-    else: # latest
-        query += " ORDER BY created DESC"
+    query += f" ORDER BY {sort_expr} DESC, p.id DESC LIMIT ?"
+    params.append(limit + 1)
+    return query, params
+
+def fetch_listing_page(conn, kind, sort, search_query='', cursor=None, limit=20):
+    """Returns (rows, next_cursor) for one page of a listing. Raises InvalidCursor if the cursor cannot be decoded."""
+    if use_ranked_index(search_query):
+        sort_key = listing_sort_key(kind, sort)
+        return fetch_ranked_page(conn, kind, sort_key, cursor, limit)
+
+    query, params = build_listing_query(kind, sort, search_query, cursor, limit)
+    rows = conn.execute(query, params).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['sort_value'], rows[-1]['id'])
+    return rows, next_cursor
+
+def fetch_posts_by_ids(conn, sort_key, post_ids):
+    """Fetches listing rows for post_ids by primary key, returned in the order of post_ids."""
+    if not post_ids:
+        return []
+    placeholders = ','.join('?' * len(post_ids))
+    rows = conn.execute(f"""SELECT p.id, p.username, p.content, p.image_filename, p.created, p.sigma,
+                                   p.original_poster_anon_id, p.title, {COMMENT_COUNT_SQL} AS total_comments,
+                                   {sort_key_expression(sort_key)} AS sort_value
+                            FROM posts p WHERE p.id IN ({placeholders})""", post_ids).fetchall()
+    by_id = {row['id']: row for row in rows}
+    return [by_id[post_id] for post_id in post_ids if post_id in by_id]
+
+# --- Trending (sliding-window vote counters) ---
+# Net sigma change per post per minute, kept in memory for the longest window with a running total
+# per window, so trending sorts never scan the votes table. Minutes that leave a window are
+# subtracted from its totals as time moves on. Buckets are written to vote_buckets every
+# TRENDING_FLUSH_SECONDS from the vote path and reloaded at startup, so a restart loses at most
+# that much recent activity.
+def current_minute():
+    return int(time.time() // 60)
+
+class TrendingCounters:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {} # minute -> {post_id: net sigma change}
+        self._totals = {sort_key: {} for sort_key in TRENDING_WINDOWS} # sort key -> {post_id: total}
+        self._dirty = set() # (minute, post_id) changed since the last flush
+        self._last_flush = time.monotonic()
+        self._window_start = self._window_starts(current_minute())
+
+    @staticmethod
+    def _window_starts(now):
+        # First minute still inside each window
+        return {sort_key: now - window + 1 for sort_key, window in TRENDING_WINDOWS.items()}
+
+    def load(self, conn):
+        now = current_minute()
+        starts = self._window_starts(now)
+        rows = conn.execute("SELECT post_id, minute, delta FROM vote_buckets WHERE minute >= ?",
+                            (min(starts.values()),)).fetchall()
+        with self._lock:
+            self._buckets = {}
+            self._totals = {sort_key: {} for sort_key in TRENDING_WINDOWS}
+            self._window_start = starts
+            for row in rows:
+                self._buckets.setdefault(row['minute'], {})[row['post_id']] = row['delta']
+                for sort_key, start in starts.items():
+                    if row['minute'] >= start:
+                        totals = self._totals[sort_key]
+                        totals[row['post_id']] = totals.get(row['post_id'], 0) + row['delta']
+
+    def totals_for(self, post_id):
+        with self._lock:
+            return {sort_key: totals.get(post_id, 0) for sort_key, totals in self._totals.items()}
+
+    def _add(self, sort_key, post_id, delta):
+        totals = self._totals[sort_key]
+        total = totals.get(post_id, 0) + delta
+        if total:
+            totals[post_id] = total
+        else:
+            totals.pop(post_id, None)
+        ranked_index.update(post_id, **{sort_key: total})
+
+    def roll(self):
+        """Drops minutes that have left each window from its totals, and forgets buckets older than every window."""
+        now = current_minute()
+        with self._lock:
+            starts = self._window_starts(now)
+            if starts == self._window_start:
+                return
+            for sort_key, start in starts.items():
+                old_start = self._window_start[sort_key]
+                for minute in sorted(m for m in self._buckets if old_start <= m < start):
+                    for post_id, delta in self._buckets[minute].items():
+                        self._add(sort_key, post_id, -delta)
+            oldest = min(starts.values())
+            for minute in [m for m in self._buckets if m < oldest]:
+                del self._buckets[minute]
+            self._window_start = starts
+
+    def record(self, post_id, delta):
+        self.roll()
+        minute = current_minute()
+        with self._lock:
+            bucket = self._buckets.setdefault(minute, {})
+            bucket[post_id] = bucket.get(post_id, 0) + delta
+            self._dirty.add((minute, post_id))
+            for sort_key in TRENDING_WINDOWS:
+                self._add(sort_key, post_id, delta)
+
+    def take_dirty(self):
+        """Returns (rows to upsert, oldest minute to keep) for persist_vote_buckets, or None if a flush isn't due yet."""
+        with self._lock:
+            if time.monotonic() - self._last_flush < current_app.config['TRENDING_FLUSH_SECONDS']:
+                return None
+            self._last_flush = time.monotonic()
+            rows = [(post_id, minute, self._buckets[minute][post_id])
+                    for minute, post_id in self._dirty if minute in self._buckets]
+            self._dirty = set()
+            return rows, min(self._window_start.values())
+
+trending = app_state('trending')
+
+def persist_vote_buckets(conn, rows, oldest_minute):
+    """Write job: saves changed trending buckets and deletes the ones that have left every window."""
+    conn.executemany('''
+        INSERT INTO vote_buckets (post_id, minute, delta) VALUES (?, ?, ?)
+        ON CONFLICT (post_id, minute) DO UPDATE SET delta = excluded.delta
+    ''', rows)
+    conn.execute("DELETE FROM vote_buckets WHERE minute < ?", (oldest_minute,))
+
+def record_trending_vote(post_id, delta):
+    """Counts a committed post vote towards trending. Runs on the writer thread, so flushes are only queued."""
+    trending.record(post_id, delta)
+    flush = trending.take_dirty()
+    if flush:
+        db_writer.submit(persist_vote_buckets, *flush)
+
+# --- Ranked Listing Index ---
+# Sort keys kept in memory for each listing kind: whatever LISTING_SORTS can ask for
+RANKED_SORT_KEYS = {
+    kind: set(sorts.values()) | {fallback} for kind, (sorts, fallback) in LISTING_SORTS.items()
+}
+
+class RankedIndex:
+    """
+    In-memory ordering of every hot post for each (listing kind, sort key) pair, so an unsearched
+    listing page is a bisect plus a primary-key fetch instead of a filtered ORDER BY over posts.
+    Each list holds (sort value, post id) ascending and listings read it from the end, which matches
+    the (sort key DESC, id DESC) order and cursors of build_listing_query().
+    Built from the database at startup and kept current by the write jobs' on_commit callbacks.
+    Writes made by other processes (CLI commands, other workers) are picked up by sync_ranked_index(),
+    which rebuilds the index in the background; changes made while a rebuild reads its snapshot are
+    recorded and replayed onto the rebuilt lists by finish_rebuild().
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._lists = {}
+        self._posts = {} # post id -> (listing kinds, {sort key: value})
+        self._replay = None # [(method, args)] while a rebuild is running, else None
+        self.ready = False
+        self.data_version = None # Writer connection's PRAGMA data_version the index was last synced at
+        self._last_sync_check = time.monotonic()
+
+    @staticmethod
+    def _kinds(image_filename):
+        return ('all', 'photos') if image_filename else ('all', 'text')
+
+    def load(self, conn):
+        lists, posts = self.build(conn)
+        with self._lock:
+            self._lists, self._posts, self.ready = lists, posts, True
+
+    def build(self, conn):
+        """Reads every hot post from conn and returns new (lists, posts) without touching the index."""
+        rows = conn.execute(f"SELECT p.id, p.image_filename, p.sigma, p.created, {COMMENT_COUNT_SQL} AS comments FROM posts p").fetchall()
+        lists = {(kind, sort_key): [] for kind, sort_keys in RANKED_SORT_KEYS.items() for sort_key in sort_keys}
+        posts = {}
+        for row in rows:
+            kinds = self._kinds(row['image_filename'])
+            values = {'sigma': row['sigma'] or 0, 'created': row['created'] or '', 'comments': row['comments'],
+                      **trending.totals_for(row['id'])}
+            posts[row['id']] = (kinds, values)
+            for kind in kinds:
+                for sort_key in RANKED_SORT_KEYS[kind]:
+                    lists[(kind, sort_key)].append((values[sort_key], row['id']))
+        for entries in lists.values():
+            entries.sort()
+        return lists, posts
+
+    def begin_rebuild(self):
+        """Starts recording changes for a rebuild; False if one is already running."""
+        with self._lock:
+            if self._replay is not None:
+                return False
+            self._replay = []
+            return True
+
+    def finish_rebuild(self, lists, posts, data_version):
+        """Swaps in rebuilt lists, replaying the changes made since their snapshot was taken."""
+        with self._lock:
+            replay, self._replay = self._replay, None
+            self._lists, self._posts, self.ready = lists, posts, True
+            for method, args in replay:
+                method(*args)
+            self.data_version = data_version
+
+    def abandon_rebuild(self):
+        with self._lock:
+            self._replay = None
+
+    def _record(self, method, *args):
+        if self._replay is not None:
+            self._replay.append((method, args))
+
+    def _each_list(self, kinds, sort_key):
+        for kind in kinds:
+            if sort_key in RANKED_SORT_KEYS[kind]:
+                yield self._lists[(kind, sort_key)]
+
+    # Each change is applied by a private method that only touches the index, so that it can be replayed
+    # under our lock; add_post() reads the trending totals first for that reason.
+    def add_post(self, post_id, image_filename, created):
+        # Read before taking our lock: TrendingCounters calls into this index while holding its own
+        values = {'sigma': 0, 'created': created, 'comments': 0, **trending.totals_for(post_id)}
+        with self._lock:
+            self._record(self._add_post, post_id, image_filename, values)
+            self._add_post(post_id, image_filename, values)
+
+    def _add_post(self, post_id, image_filename, values):
+        if post_id in self._posts:
+            return
+        kinds = self._kinds(image_filename)
+        self._posts[post_id] = (kinds, dict(values))
+        for sort_key, value in values.items():
+            for entries in self._each_list(kinds, sort_key):
+                bisect.insort(entries, (value, post_id))
+
+    def update(self, post_id, **changes):
+        """Sets new sort values for a post, e.g. update(post_id, sigma=5). Posts not in the index are ignored."""
+        with self._lock:
+            self._record(self._update, post_id, changes)
+            self._update(post_id, changes)
+
+    def _update(self, post_id, changes):
+        if post_id not in self._posts:
+            return
+        kinds, values = self._posts[post_id]
+        for sort_key, value in changes.items():
+            for entries in self._each_list(kinds, sort_key):
+                del entries[bisect.bisect_left(entries, (values[sort_key], post_id))]
+                bisect.insort(entries, (value, post_id))
+            values[sort_key] = value
+
+    def adjust_comments(self, post_id, delta):
+        with self._lock:
+            self._record(self._adjust_comments, post_id, delta)
+            self._adjust_comments(post_id, delta)
+
+    def _adjust_comments(self, post_id, delta):
+        if post_id in self._posts:
+            self._update(post_id, {'comments': self._posts[post_id][1]['comments'] + delta})
+
+    def remove_posts(self, post_ids):
+        with self._lock:
+            self._record(self._remove_posts, list(post_ids))
+            self._remove_posts(post_ids)
+
+    def _remove_posts(self, post_ids):
+        for post_id in post_ids:
+            if post_id not in self._posts:
+                continue
+            kinds, values = self._posts.pop(post_id)
+            for sort_key, value in values.items():
+                for entries in self._each_list(kinds, sort_key):
+                    del entries[bisect.bisect_left(entries, (value, post_id))]
+
+    def claim_sync_check(self, force=False):
+        """Whether a sync check is due (at most every RANKED_INDEX_SYNC_SECONDS unless forced); claims it if so."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_sync_check < current_app.config['RANKED_INDEX_SYNC_SECONDS']:
+                return False
+            self._last_sync_check = now
+            return True
+
+    def page(self, kind, sort_key, cursor=None, limit=20):
+        """Returns (post ids, next_cursor) for one listing page. Raises InvalidCursor if the cursor cannot be decoded."""
+        with self._lock:
+            entries = self._lists[(kind, sort_key)]
+            end = len(entries)
+            if cursor:
+                try:
+                    end = bisect.bisect_left(entries, tuple(decode_cursor(cursor)))
+                except TypeError: # Cursor value of the wrong type for this sort key
+                    raise InvalidCursor(cursor)
+            start = max(0, end - limit)
+            page = entries[start:end]
+        next_cursor = encode_cursor(*page[0]) if start > 0 else None
+        return [post_id for _, post_id in reversed(page)], next_cursor
+
+ranked_index = app_state('ranked_index')
+
+def use_ranked_index(search_query):
+    # Search needs LIKE matching, so it always goes to SQL
+    return current_app.config['RANKED_INDEX_ENABLED'] and ranked_index.ready and not search_query
+
+def ranked_listing_page(kind, sort_key, cursor=None, limit=20):
+    sync_ranked_index()
+    if sort_key in TRENDING_WINDOWS:
+        trending.roll() # Let minutes that have left the window drop out before ranking
+    return ranked_index.page(kind, sort_key, cursor, limit)
+
+def read_data_version(conn):
+    """Write job (transaction=False): the writer connection's PRAGMA data_version, which only moves when another connection commits."""
+    return conn.execute('PRAGMA data_version').fetchone()[0]
+
+def reload_ranked_index(data_version):
+    """
+    on_commit of read_data_version: starts a background rebuild if another process has committed.
+    Only the snapshot is taken here on the writer thread, between two local commits, so every local
+    write is either in it or recorded for replay; the full read runs in rebuild_ranked_index().
+    """
+    if data_version == ranked_index.data_version or not ranked_index.begin_rebuild():
+        return
+    try:
+        conn = get_db_connection(check_same_thread=False)
+        conn.execute('BEGIN')
+        conn.execute('SELECT 1 FROM posts LIMIT 1') # A WAL reader's snapshot is fixed by its first read
+    except sqlite3.Error as e:
+        ranked_index.abandon_rebuild()
+        print(f"Error starting ranked index rebuild: {e}", file=sys.stderr)
+        return
+    threading.Thread(target=rebuild_ranked_index, args=(current_app._get_current_object(), conn, data_version),
+                     name='ranked-index-rebuild', daemon=True).start()
+
+def rebuild_ranked_index(app, conn, data_version):
+    with app.app_context():
+        try:
+            lists, posts = ranked_index.build(conn)
+        except sqlite3.Error as e:
+            ranked_index.abandon_rebuild() # data_version is left as it was, so the next sync check retries
+            print(f"Error rebuilding ranked index: {e}", file=sys.stderr)
+            return
+        finally:
+            conn.close()
+        ranked_index.finish_rebuild(lists, posts, data_version)
+        metrics.inc('anonboard_ranked_index_reloads_total')
+
+def sync_ranked_index(force=False):
+    """
+    Queues a check for writes committed by other processes and rebuilds the ranked index if there were
+    any. Every local write goes through the writer connection, so its data_version only changes for
+    those. The check runs in the background; the page being served still comes from the current index.
+    With several workers any commit triggers a rebuild in each of the others, at most once per
+    RANKED_INDEX_SYNC_SECONDS; it reads every hot post but no longer holds up the write queue.
+    """
+    if ranked_index.claim_sync_check(force):
+        db_writer.submit(read_data_version, transaction=False, on_commit=reload_ranked_index)
 
-    posts_data = []
+def fetch_ranked_page(conn, kind, sort_key, cursor=None, limit=20):
+    """
+    Returns (rows, next_cursor) for a listing page served from the ranked index. Ids whose post is
+    gone (removed by another process since the last sync) are skipped and the page is topped up from
+    further down the index, so it never comes back short while more posts exist.
+    """
+    rows = []
+    while True:
+        post_ids, next_cursor = ranked_listing_page(kind, sort_key, cursor, limit - len(rows))
+        fetched = fetch_posts_by_ids(conn, sort_key, post_ids)
+        if len(fetched) < len(post_ids):
+            sync_ranked_index(force=True)
+        rows.extend(fetched)
+        if len(rows) >= limit or next_cursor is None:
+            return rows, next_cursor
+        cursor = next_cursor
+
+def load_listing_indexes():
     conn = get_db_connection()
     try:
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        fetched_posts = cursor.fetchall()
+        trending.load(conn) # First: the ranked index reads the trending totals
+        ranked_index.load(conn)
+    finally:
+        conn.close()
 
-        for post_row in fetched_posts:
-            post_id = post_row['id']
-            user_vote_type = None
-            if g.anon_id != "0000":
-                cursor.execute("SELECT type FROM votes WHERE post_id = ? AND voter_anon_id = ?", (post_id, g.anon_id))
-                vote_row = cursor.fetchone()
-                if vote_row:
-                    user_vote_type = vote_row['type']
+class ListingPage:
+    """
+    Lazily iterated page of a listing, handed to stream_template() as `posts`.
+
+    Nothing touches the database until the template reaches its post loop, so the head, nav
+    and sidebar are already on the wire while the rows are read. Rows are pulled from the
+    cursor LISTING_FETCH_CHUNK at a time and each chunk is passed to `format_chunk(conn, rows)`,
+    which does its batched vote/comment lookups and returns the items the template expects.
+    `next_cursor` is only known once iteration has finished, so templates must read it after the loop.
+    """
+
+    def __init__(self, kind, sort, search_query, format_chunk, limit=20):
+        self.kind = kind
+        self.sort = sort
+        self.search_query = search_query
+        self.format_chunk = format_chunk
+        self.limit = limit
+        self.next_cursor = None
+
+    def __iter__(self):
+        chunk_size = current_app.config['LISTING_FETCH_CHUNK']
+        conn = get_db_connection()
+        try:
+            if use_ranked_index(self.search_query):
+                sort_key = listing_sort_key(self.kind, self.sort)
+                remaining = self.limit
+                next_cursor = None
+                while True:
+                    post_ids, next_cursor = ranked_listing_page(self.kind, sort_key, next_cursor, remaining)
+                    for start in range(0, len(post_ids), chunk_size):
+                        rows = fetch_posts_by_ids(conn, sort_key, post_ids[start:start + chunk_size])
+                        remaining -= len(rows)
+                        yield from self.format_chunk(conn, rows)
+                    if remaining <= 0 or next_cursor is None:
+                        break
+                    # Some posts were removed by another process; top the page up, see fetch_ranked_page()
+                    sync_ranked_index(force=True)
+                self.next_cursor = next_cursor
+                return
+
+            query, params = build_listing_query(self.kind, self.sort, self.search_query, limit=self.limit)
+            cursor = conn.execute(query, params)
+            remaining = self.limit
+            last_row = None
+            while remaining > 0:
+                rows = cursor.fetchmany(min(chunk_size, remaining))
+                if not rows:
+                    break
+                remaining -= len(rows)
+                last_row = rows[-1]
+                yield from self.format_chunk(conn, rows)
+            # The query fetched limit + 1 rows; if the extra one is there, another page exists
+            if remaining == 0 and cursor.fetchone() is not None:
+                self.next_cursor = encode_cursor(last_row['sort_value'], last_row['id'])
+        except sqlite3.Error as e:
+            # Headers are already sent by now, so this can no longer be flashed to the user
+            print(f"Error streaming {self.kind} listing: {e}", file=sys.stderr)
+        finally:
+            conn.close()
+
+def stream_listing_template(template_name, **context):
+    """
+    Streams a listing template. The CSRF token is generated up front because the session
+    cookie is written before the body starts streaming; a token first created mid-stream would be lost.
+    """
+    generate_csrf()
+    return buffer_template_stream(stream_template(template_name, **context), current_app.config['LISTING_STREAM_BUFFER'])
 
+def buffer_template_stream(chunks, size):
+    """
+    Joins a template's output into chunks of `size` pieces with Jinja's stream buffering. Unbuffered,
+    every template event (often a few bytes) would be its own write to the client.
+    """
+    stream = TemplateStream(chunks)
+    stream.enable_buffering(size)
+    try:
+        yield from stream
+    finally:
+        chunks.close() # Ends the stream's request context when the server closes the response
+
+def fetch_user_post_votes(conn, anon_id, post_ids):
+    """Returns {post_id: 'up'|'down'} for the viewer's votes on the given posts, in one query."""
+    if not post_ids or not anon_id or anon_id == "0000":
+        return {}
+    placeholders = ','.join('?' * len(post_ids))
+    rows = conn.execute(
+        f"SELECT post_id, type FROM votes WHERE voter_anon_id = ? AND post_id IN ({placeholders})",
+        [anon_id, *post_ids]
+    ).fetchall()
+    return {row['post_id']: row['type'] for row in rows}
+
+def fetch_user_comment_votes(conn, anon_id, comment_ids):
+    """Returns {comment_id: 'up'|'down'} for the viewer's votes on the given comments, in one query."""
+    if not comment_ids or not anon_id or anon_id == "0000":
+        return {}
+    placeholders = ','.join('?' * len(comment_ids))
+    rows = conn.execute(
+        f"SELECT comment_id, type FROM comment_votes WHERE voter_anon_id = ? AND comment_id IN ({placeholders})",
+        [anon_id, *comment_ids]
+    ).fetchall()
+    return {row['comment_id']: row['type'] for row in rows}
+
+def fetch_latest_comments(conn, post_ids, per_post=2):
+    """Returns {post_id: [comment rows, newest first]} with at most `per_post` comments each, in one query."""
+    if not post_ids:
+        return {}
+    placeholders = ','.join('?' * len(post_ids))
+    rows = conn.execute(f"""
+        SELECT id, post_id, commenter_anon_id, content, created, sigma, parent_id, depth, reply_count FROM (
+            SELECT c.*, ROW_NUMBER() OVER (PARTITION BY c.post_id ORDER BY c.created DESC, c.id DESC) AS rn
+            FROM comments c WHERE c.post_id IN ({placeholders})
+        ) WHERE rn <= ? ORDER BY post_id, created DESC, id DESC
+    """, [*post_ids, per_post]).fetchall()
+    latest = {}
+    for row in rows:
+        latest.setdefault(row['post_id'], []).append(row)
+    return latest
+
+def fetch_comment_page(conn, post_id, cursor=None, limit=50):
+    """Returns (rows, next_cursor) for a post's comments, oldest first, keyset-paginated on (created, id)."""
+    query = f"SELECT {COMMENT_TREE_COLUMNS} FROM comments WHERE post_id = ?"
+    params = [post_id]
+    if cursor:
+        created, last_id = decode_comment_cursor(cursor, 'created')
+        query += " AND (created > ? OR (created = ? AND id > ?))"
+        params.extend([created, created, last_id])
+    query += " ORDER BY created ASC, id ASC LIMIT ?"
+    params.append(limit + 1)
+
+    rows = conn.execute(query, params).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created'], rows[-1]['id'])
+    return rows, next_cursor
+
+# --- Comment Threads ---
+# Each comment stores its materialized path: the zero-padded ids of its ancestors and itself joined
+# by '.', so sorting by path lists a thread depth-first with siblings oldest first, and a subtree is
+# the contiguous path range starting at its root. With the (post_id, path, depth) index any subtree,
+# cut off at a depth, is one range scan. Post pages show COMMENT_PAGE_SIZE top-level comments in the
+# chosen sort, each with up to COMMENT_THREAD_REPLIES replies COMMENT_TREE_DEPTH levels deep; more
+# comments, more replies and collapsed deeper branches are fetched on demand.
+DEFAULT_CONFIG['COMMENT_PAGE_SIZE'] = 20 # Top-level comments per page
+DEFAULT_CONFIG['COMMENT_THREAD_REPLIES'] = 10 # Replies loaded under a comment per request
+DEFAULT_CONFIG['COMMENT_TREE_DEPTH'] = 4 # Levels loaded per request, counting the comment the replies hang from
+COMMENT_TREE_COLUMNS = "id, commenter_anon_id, content, created, sigma, parent_id, path, depth, reply_count"
+
+# Sort name -> (column, direction) for top-level comments; replies always follow thread order
+COMMENT_SORTS = {
+    'top': ('sigma', 'DESC'),
+    'new': ('created', 'DESC'),
+    'old': ('created', 'ASC'),
+}
+DEFAULT_COMMENT_SORT = 'top'
+COMMENT_CURSOR_TYPES = {'sigma': int, 'created': str, 'path': str} # What each keyset column's cursor value must be
+
+def decode_comment_cursor(cursor, column):
+    """decode_cursor() for comment pages; the sort value must also fit the column it is compared with."""
+    sort_value, last_id = decode_cursor(cursor)
+    if not isinstance(sort_value, COMMENT_CURSOR_TYPES[column]):
+        raise InvalidCursor(cursor)
+    return sort_value, last_id
+
+def comment_path(parent_path, comment_id):
+    # Ten digits keep lexical order equal to numeric order for every id SQLite will hand out here
+    segment = f"{comment_id:010d}"
+    return f"{parent_path}.{segment}" if parent_path else segment
+
+def comment_subtree_range(path):
+    """Returns (low, high) such that low <= p < high holds exactly for the comment at path and its replies."""
+    # '/' sorts right after '.', so every descendant path (path + '.' + ...) falls inside the range
+    return path, path + '/'
+
+def fetch_comment_replies(conn, post_id, root, max_depth, cursor=None, limit=10):
+    """
+    Returns (rows, next_cursor) for up to `limit` replies below the comment row `root`, in thread order
+    and down to max_depth (top-level comments are depth 0). Later pages continue after the cursor's path.
+    Raises InvalidCursor if the cursor cannot be decoded.
+    """
+    low, high = comment_subtree_range(root['path'])
+    if cursor:
+        after_path, _ = decode_comment_cursor(cursor, 'path')
+        low = max(low, after_path)
+    rows = conn.execute(
+        f"SELECT {COMMENT_TREE_COLUMNS} FROM comments WHERE post_id = ? AND path > ? AND path < ? AND depth <= ? ORDER BY path LIMIT ?",
+        (post_id, low, high, max_depth, limit + 1)
+    ).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['path'], rows[-1]['id'])
+    return rows, next_cursor
+
+def fetch_comment_threads(conn, post_id, sort=DEFAULT_COMMENT_SORT, cursor=None, limit=20, replies_per_thread=10, max_depth=None):
+    """
+    Returns (threads, next_cursor) for one page of a post's top-level comments, keyset-paginated on
+    (sort column, id). Each thread is (rows, replies_cursor): the top-level comment followed by up to
+    replies_per_thread of its replies down to max_depth. Raises InvalidCursor if the cursor cannot be decoded.
+    """
+    column, direction = COMMENT_SORTS.get(sort, COMMENT_SORTS[DEFAULT_COMMENT_SORT])
+    if max_depth is None:
+        max_depth = current_app.config['COMMENT_TREE_DEPTH'] - 1
+    comparison = '<' if direction == 'DESC' else '>'
+    query = f"SELECT {COMMENT_TREE_COLUMNS} FROM comments WHERE post_id = ? AND depth = 0"
+    params = [post_id]
+    if cursor:
+        sort_value, last_id = decode_comment_cursor(cursor, column)
+        query += f" AND ({column} {comparison} ? OR ({column} = ? AND id {comparison} ?))"
+        params.extend([sort_value, sort_value, last_id])
+    query += f" ORDER BY {column} {direction}, id {direction} LIMIT ?"
+    params.append(limit + 1)
+
+    roots = conn.execute(query, params).fetchall()
+    next_cursor = None
+    if len(roots) > limit:
+        roots = roots[:limit]
+        next_cursor = encode_cursor(roots[-1][column], roots[-1]['id'])
+
+    threads = []
+    for root in roots:
+        replies, replies_cursor = [], None
+        if root['reply_count'] and max_depth > 0:
+            replies, replies_cursor = fetch_comment_replies(conn, post_id, root, max_depth, limit=replies_per_thread)
+        threads.append(([root, *replies], replies_cursor))
+    return threads, next_cursor
+
+def collapsed_replies(row, max_depth):
+    """Number of direct replies not loaded because row sits at the depth cutoff."""
+    return (row['reply_count'] or 0) if row['depth'] >= max_depth else 0
+
+
+# --- Leaderboard ---
+# Top users by sigma all-time and gained in the current day/week, kept in memory and updated by
+# every committed vote, so neither the page nor the API sorts the users table.
+LEADERBOARD_PERIODS = ('all', 'day', 'week')
+DEFAULT_CONFIG['LEADERBOARD_SIZE'] = 50
+DEFAULT_CONFIG['LEADERBOARD_SNAPSHOT_SECONDS'] = 60 # How often day/week scores are saved to leaderboard_snapshot
+
+def period_start(period):
+    now = datetime.now()
+    if period == 'day':
+        return now.strftime("%Y-%m-%d")
+    if period == 'week':
+        return (now - timedelta(days=now.weekday())).strftime("%Y-%m-%d")
+    return ''
+
+class TopK:
+    """
+    The best k (key, score) pairs of a larger population, best first, ties broken by key.
+    Holds up to 2k entries so members can slip a little without losing their place. Once an update
+    pushes a member below the weakest entry held, it is dropped: outsiders may rank between them.
+    If fewer than k entries remain, `source(limit)` is asked for the current best `limit` pairs.
+    Updates are a bisect on a list of at most 2k entries.
+    """
+
+    def __init__(self, k, source):
+        self.k = k
+        self.capacity = 2 * k
+        self._source = source
+        self._entries = [] # (-score, key), ascending = best first
+        self._scores = {}
+        self._truncated = False # True if the population may hold keys that are not in _entries
+        self.refill()
+
+    def refill(self):
+        pairs = self._source(self.capacity)
+        self._entries = sorted((-score, key) for key, score in pairs)
+        self._scores = dict(pairs)
+        self._truncated = len(pairs) >= self.capacity
+
+    def update(self, key, score):
+        if key in self._scores:
+            del self._entries[bisect.bisect_left(self._entries, (-self._scores.pop(key), key))]
+        entry = (-score, key)
+        if not self._truncated or (self._entries and entry < self._entries[-1]):
+            bisect.insort(self._entries, entry)
+            self._scores[key] = score
+            if len(self._entries) > self.capacity:
+                _, evicted = self._entries.pop()
+                del self._scores[evicted]
+                self._truncated = True
+        if len(self._entries) < self.k and self._truncated:
+            self.refill()
+
+    def top(self, limit=None):
+        limit = self.k if limit is None else min(limit, self.k)
+        return [(key, -neg_score) for neg_score, key in self._entries[:limit]]
+
+def fetch_top_users(limit):
+    conn = get_db_connection()
+    try:
+        rows = conn.execute("SELECT anon_id, total_sigma FROM users ORDER BY total_sigma DESC, anon_id LIMIT ?", (limit,)).fetchall()
+    finally:
+        conn.close()
+    return [(row['anon_id'], row['total_sigma']) for row in rows]
+
+class Leaderboard:
+    """
+    One TopK per period. The all-time board follows users.total_sigma and refills from the users
+    table. The day/week boards follow sigma gained in the current period, kept in memory for every
+    user active in it, saved to leaderboard_snapshot periodically and reloaded at startup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._boards = {}
+        self._gains = {} # period -> {anon_id: sigma gained since period_start}
+        self._starts = {} # period -> period_start the gains belong to
+        self._dirty = set() # (period, anon_id) whose gain changed since the last snapshot
+        self._rolled = set() # periods that started over since the last snapshot
+        self._last_snapshot = time.monotonic()
+
+    def _period_board(self, period):
+        gains = self._gains[period]
+        return TopK(current_app.config['LEADERBOARD_SIZE'],
+                    lambda limit: sorted(gains.items(), key=lambda pair: (-pair[1], pair[0]))[:limit])
+
+    def load(self, conn):
+        with self._lock:
+            self._boards['all'] = TopK(current_app.config['LEADERBOARD_SIZE'], fetch_top_users)
+            for period in LEADERBOARD_PERIODS[1:]:
+                start = period_start(period)
+                rows = conn.execute("SELECT anon_id, score FROM leaderboard_snapshot WHERE period = ? AND period_start = ?",
+                                    (period, start)).fetchall()
+                self._gains[period] = {row['anon_id']: row['score'] for row in rows}
+                self._starts[period] = start
+                self._boards[period] = self._period_board(period)
+
+    def _roll_periods(self):
+        for period in LEADERBOARD_PERIODS[1:]:
+            start = period_start(period)
+            if start != self._starts[period]:
+                self._gains[period] = {}
+                self._starts[period] = start
+                self._dirty = {(dirty_period, anon_id) for dirty_period, anon_id in self._dirty if dirty_period != period}
+                self._rolled.add(period)
+                self._boards[period] = self._period_board(period)
+
+    def record_vote(self, anon_id, total_sigma, sigma_change):
+        """Applies one committed vote on anon_id's content. Returns the periods whose top list changed."""
+        changed = []
+        with self._lock:
+            self._roll_periods()
+            scores = {'all': total_sigma}
+            for period in LEADERBOARD_PERIODS[1:]:
+                gains = self._gains[period]
+                gains[anon_id] = gains.get(anon_id, 0) + sigma_change
+                scores[period] = gains[anon_id]
+                self._dirty.add((period, anon_id))
+            for period, score in scores.items():
+                board = self._boards[period]
+                before = board.top()
+                board.update(anon_id, score)
+                if board.top() != before:
+                    changed.append(period)
+        return changed
+
+    def top(self, period, limit=None):
+        with self._lock:
+            self._roll_periods()
+            pairs = self._boards[period].top(limit)
+        return [{'rank': rank, 'anon_id': anon_id, 'score': score} for rank, (anon_id, score) in enumerate(pairs, 1)]
+
+    def take_snapshot(self):
+        """
+        Returns (changed rows, [(period, period_start)] of periods that started over) for
+        persist_leaderboard_snapshot, or None if a snapshot isn't due or nothing changed.
+        """
+        with self._lock:
+            if time.monotonic() - self._last_snapshot < current_app.config['LEADERBOARD_SNAPSHOT_SECONDS']:
+                return None
+            self._last_snapshot = time.monotonic()
+            if not self._dirty and not self._rolled:
+                return None
+            rows = [(period, self._starts[period], anon_id, self._gains[period][anon_id]) for period, anon_id in self._dirty]
+            rolled = [(period, self._starts[period]) for period in self._rolled]
+            self._dirty = set()
+            self._rolled = set()
+            return rows, rolled
+
+leaderboard = app_state('leaderboard')
+
+def persist_leaderboard_snapshot(conn, rows, rolled):
+    """Write job: saves the day/week scores that changed since the last snapshot and drops those of finished periods."""
+    for period, start in rolled:
+        conn.execute("DELETE FROM leaderboard_snapshot WHERE period = ? AND period_start != ?", (period, start))
+    conn.executemany('''
+        INSERT INTO leaderboard_snapshot (period, period_start, anon_id, score) VALUES (?, ?, ?, ?)
+        ON CONFLICT (period, anon_id) DO UPDATE SET period_start = excluded.period_start, score = excluded.score
+    ''', rows)
+
+def leaderboard_room(period):
+    return f"leaderboard:{period}"
+
+def record_leaderboard_vote(anon_id, total_sigma, sigma_change):
+    """
+    Counts a committed vote towards the leaderboards and returns the periods whose board changed.
+    Runs on the writer thread, which must not emit (an eventlet server can't be driven from a native
+    thread), so the request pushes the changed boards with emit_leaderboard_updates().
+    """
+    periods = leaderboard.record_vote(anon_id, total_sigma, sigma_change)
+    snapshot = leaderboard.take_snapshot()
+    if snapshot is not None:
+        db_writer.submit(persist_leaderboard_snapshot, *snapshot)
+    return periods
+
+def emit_leaderboard_updates(periods):
+    for period in periods:
+        # Only leaderboard pages join these rooms, see handle_join_leaderboard()
+        emit_event('leaderboard_update', {'period': period, 'entries': leaderboard.top(period)}, to=leaderboard_room(period))
+
+def load_leaderboard():
+    conn = get_db_connection()
+    try:
+        leaderboard.load(conn)
+    finally:
+        conn.close()
+
+
+# --- Routes ---
+@bp.route('/')
+@bp.route('/feed')
+def feed():
+    sort = request.args.get("sort", "best")
+    view = request.args.get("view", "card")
+    search_query = request.args.get("q", "").strip()
+
+    def format_chunk(conn, fetched_posts):
+        user_votes = fetch_user_post_votes(conn, g.anon_id, [row['id'] for row in fetched_posts])
+        for post_row in fetched_posts:
             # post: [id, username, content, image_filename, created, sigma, original_poster_anon_id, user_vote_status, title]
             post_list = [
                 post_row['id'],
@@ -329,22 +2534,17 @@ def feed():
                 post_row['created'], # raw timestamp string, will be filtered in template
                 post_row['sigma'],
                 post_row['original_poster_anon_id'],
-                user_vote_type,
-                
+                user_votes.get(post_row['id']),
             ]
-            posts_data.append(tuple(post_list))
+            yield tuple(post_list)
 
-    except Exception as e:
-        flash(f"Error loading posts: {str(e)}", "danger")
-        posts_data = []
-    finally:
-        conn.close()
+    posts = ListingPage('all', sort, search_query, format_chunk, limit=current_app.config['LISTING_PAGE_SIZE'])
 
     delete_post_form = DeletePostForm()
 
-    return render_template(
+    return stream_listing_template(
         "feed.html",
-        posts=posts_data,
+        posts=posts,
         anon_id=g.anon_id,
         join_date=g.join_date,
         sigma_score=g.sigma_score,
@@ -358,12 +2558,18 @@ def feed():
     )
 
 # app.py snippet for /post_detail/<int:post_id> route
-@app.route('/post/<int:post_id>')
+@bp.route('/post/<int:post_id>')
 def post_detail(post_id):
     post = None
-    comments_for_template = []
-
-    conn = get_db_connection()
+    archived = False
+    comments_for_template = [] # [(comment tuples of one thread, cursor for the rest of its replies)]
+    comment_count = 0
+    next_comments_cursor = None
+    comment_sort = request.args.get('comment_sort', DEFAULT_COMMENT_SORT)
+    if comment_sort not in COMMENT_SORTS:
+        comment_sort = DEFAULT_COMMENT_SORT
+
+    conn = get_post_connection(post_id)
     try:
         cursor = conn.cursor()
         # Fetch post details
@@ -391,30 +2597,35 @@ def post_detail(post_id):
                 post_raw['title']            # [8] - This is the post title
             ]
             post = tuple(post_list)
+            archived = conn.database == current_app.config['ARCHIVE_DATABASE'] # Archived posts are read-only
 
-            # Fetch comments for the post
-            cursor.execute("SELECT id, commenter_anon_id, content, created, sigma FROM comments WHERE post_id = ? ORDER BY created ASC", (post_id,))
-            fetched_comments = cursor.fetchall()
+            comment_count = cursor.execute("SELECT COUNT(*) FROM comments WHERE post_id = ?", (post_id,)).fetchone()[0]
 
-            for comment_row in fetched_comments:
-                comment_id = comment_row['id']
-                user_comment_vote_type = None
-                if g.anon_id != "0000":
-                    cursor.execute("SELECT type FROM comment_votes WHERE comment_id = ? AND voter_anon_id = ?", (comment_id, g.anon_id))
-                    comment_vote_row = cursor.fetchone()
-                    if comment_vote_row:
-                        user_comment_vote_type = comment_vote_row['type']
-
-                # comment: [id, commenter_anon_id, content, sigma, user_vote_status, created]
-                comment_list = [
-                    comment_row['id'],
-                    comment_row['commenter_anon_id'],
-                    comment_row['content'],
-                    comment_row['sigma'],
-                    user_comment_vote_type,
-                    comment_row['created']
-                ]
-                comments_for_template.append(tuple(comment_list))
+            # Fetch the first page of comment threads; later pages, longer threads and deeper replies load on demand
+            max_depth = current_app.config['COMMENT_TREE_DEPTH'] - 1
+            threads, next_comments_cursor = fetch_comment_threads(
+                conn, post_id, comment_sort, limit=current_app.config['COMMENT_PAGE_SIZE'],
+                replies_per_thread=current_app.config['COMMENT_THREAD_REPLIES'], max_depth=max_depth
+            )
+            comment_votes = fetch_user_comment_votes(conn, g.anon_id, [row['id'] for rows, _ in threads for row in rows])
+
+            for thread_rows, replies_cursor in threads:
+                thread_comments = []
+                for comment_row in thread_rows:
+                    # comment: [id, commenter_anon_id, content, sigma, user_vote_status, created, parent_id, depth, collapsed_replies]
+                    comment_list = [
+                        comment_row['id'],
+                        comment_row['commenter_anon_id'],
+                        comment_row['content'],
+                        comment_row['sigma'],
+                        comment_votes.get(comment_row['id']),
+                        comment_row['created'],
+                        comment_row['parent_id'],
+                        comment_row['depth'],
+                        collapsed_replies(comment_row, max_depth)
+                    ]
+                    thread_comments.append(tuple(comment_list))
+                comments_for_template.append((thread_comments, replies_cursor))
 
     except Exception as e:
         flash(f"Error loading post details: {str(e)}", "danger")
@@ -425,7 +2636,7 @@ def post_detail(post_id):
 
     if not post:
         flash("Post not found.", "danger")
-        return redirect(url_for('feed'))
+        return redirect(url_for('board.feed'))
 
     comment_form = CommentForm()
     delete_post_form = DeletePostForm()
@@ -442,7 +2653,11 @@ def post_detail(post_id):
     return render_template(
         template_to_render, # Use the determined template
         post=post,
-        comments=comments_for_template,
+        archived=archived,
+        comment_threads=comments_for_template,
+        comment_count=comment_count,
+        comment_sort=comment_sort,
+        next_comments_cursor=next_comments_cursor,
         anon_id=g.anon_id,
         join_date=g.join_date,
         sigma_score=g.sigma_score,
@@ -456,7 +2671,7 @@ def post_detail(post_id):
 
 
             
-@app.route('/create_post', methods=['GET', 'POST'])
+@bp.route('/create_post', methods=['GET', 'POST'])
 def create_post():
     form = PostForm()
     if form.validate_on_submit():
@@ -464,18 +2679,17 @@ def create_post():
         content = form.content.data
         image_file = form.image.data
         anon_id = g.anon_id
-        username = f"Anon{anon_id}" # Using AnonID as display name
 
         image_filename = None
         if image_file and image_file.filename:
             if allowed_file(image_file.filename):
                 filename = secure_filename(image_file.filename)
                 unique_filename = f"{anon_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{filename}"
-                image_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+                image_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
                 file_size = len(image_file.read()) # Read file size *before* saving
                 image_file.seek(0) # Reset file pointer after reading size
-                if file_size > app.config['MAX_CONTENT_LENGTH']:
-                    flash(f'File size exceeds limit of {app.config["MAX_CONTENT_LENGTH"] / (1024 * 1024):.0f} MB.', 'warning')
+                if file_size > current_app.config['MAX_CONTENT_LENGTH']:
+                    flash(f'File size exceeds limit of {current_app.config["MAX_CONTENT_LENGTH"] / (1024 * 1024):.0f} MB.', 'warning')
                     return render_template('create_post.html', form=form)
 
                 image_file.save(image_path)
@@ -489,42 +2703,42 @@ def create_post():
             return render_template('create_post.html', form=form)
 
         try:
-            conn = get_db_connection()
-            conn.execute('''
-                INSERT INTO posts (username, content, title, image_filename, original_poster_anon_id, sigma, created)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (username, content, title, image_filename, anon_id, 0, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-            conn.commit()
-            conn.close()
+            created = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            db_writer.run(insert_post, anon_id, title, content, image_filename, created,
+                          on_commit=lambda new_post_id: ranked_index.add_post(new_post_id, image_filename, created))
+            metrics.inc('anonboard_posts_created_total', kind='photo' if image_filename else 'text')
             flash('Post created successfully!', 'success')
-            return redirect(url_for('feed'))
+            return redirect(url_for('board.feed'))
         except Exception as e:
             flash(f'Failed to create post: {str(e)}', 'danger')
             return render_template('create_post.html', form=form)
 
     return render_template('create_post.html', form=form)
 
-@app.route('/post/<int:post_id>/add_comment', methods=['POST'])
+@bp.route('/post/<int:post_id>/add_comment', methods=['POST'])
 def add_generic_comment(post_id):
     form = CommentForm()
     if form.validate_on_submit(): # This validates the CSRF token and comment_content
         comment_content = form.comment_content.data
         anon_id = g.anon_id
+        try:
+            parent_id = int(form.parent_id.data) if form.parent_id.data else None
+        except ValueError:
+            flash("Invalid reply target.", 'danger')
+            return redirect(url_for('board.post_detail', post_id=post_id))
 
         try:
-            conn = get_db_connection()
             current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            conn.execute('''
-                INSERT INTO comments (post_id, commenter_anon_id, content, created, sigma)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (post_id, anon_id, comment_content, current_time, 0))
-            conn.commit()
-            flash('Comment added successfully!', 'success')
+            comment_id = db_writer.run(insert_comment, post_id, anon_id, comment_content, current_time, parent_id,
+                                       on_commit=lambda comment_id: ranked_index.adjust_comments(post_id, 1))
+            metrics.inc('anonboard_comments_created_total')
+            flash('Reply added successfully!' if parent_id else 'Comment added successfully!', 'success')
+            # A new top-level comment is first under 'new'; a reply stays in its thread's page
+            comment_sort = None if parent_id else 'new'
+            return redirect(url_for('board.post_detail', post_id=post_id, comment_sort=comment_sort, _anchor=f"comment-{comment_id}"))
         except Exception as e:
             flash(f'Failed to add comment: {str(e)}', 'danger')
             print(f"Error adding comment: {e}", file=sys.stderr)
-        finally:
-            conn.close()
     else:
         # If validation fails (e.g., CSRF token missing/invalid, or content too long)
         for field, errors in form.errors.items():
@@ -533,9 +2747,9 @@ def add_generic_comment(post_id):
         if not form.csrf_token.data:
              flash("CSRF token missing or invalid. Please refresh the page and try again.", 'danger')
 
-    return redirect(url_for('post_detail', post_id=post_id))
+    return redirect(url_for('board.post_detail', post_id=post_id))
 
-@app.route('/delete_post/<int:post_id>', methods=['POST'])
+@bp.route('/delete_post/<int:post_id>', methods=['POST'])
 def delete_post(post_id):
     form = DeletePostForm()
     if form.validate_on_submit(): # This validates the CSRF token
@@ -545,36 +2759,30 @@ def delete_post(post_id):
         if post is None:
             conn.close()
             flash("Post not found.", "danger")
-            return redirect(url_for('feed'))
+            return redirect(url_for('board.feed'))
 
         # Only allow the original poster to delete
+        conn.close()
         if post['original_poster_anon_id'] != g.anon_id:
-            conn.close()
             flash("You do not have permission to delete this post.", "danger")
-            return redirect(url_for('post_detail', post_id=post_id))
+            return redirect(url_for('board.post_detail', post_id=post_id))
 
         try:
-            # Delete associated image file if exists
+            db_writer.run(delete_post_row, post_id, on_commit=lambda _: ranked_index.remove_posts([post_id]))
+            # Delete associated image file once the row is gone
             if post['image_filename']:
-                image_path = os.path.join(app.config['UPLOAD_FOLDER'], post['image_filename'])
+                image_path = os.path.join(current_app.config['UPLOAD_FOLDER'], post['image_filename'])
                 if os.path.exists(image_path):
                     os.remove(image_path)
                     print(f"Deleted image file: {image_path}")
-
-            # Database CASCADE deletes should handle comments and votes automatically due to FOREIGN KEY ON DELETE CASCADE
-            conn.execute("DELETE FROM posts WHERE id = ?", (post_id,))
-            conn.commit()
             flash("Post and its associated data deleted successfully!", "success")
         except Exception as e:
-            conn.rollback()
             flash(f"Error deleting post: {str(e)}", "danger")
-        finally:
-            conn.close()
     else:
         flash("CSRF token missing or invalid when deleting post.", "danger")
-    return redirect(url_for('feed'))
+    return redirect(url_for('board.feed'))
 
-@app.route('/delete_comment/<int:comment_id>', methods=['POST'])
+@bp.route('/delete_comment/<int:comment_id>', methods=['POST'])
 def delete_comment(comment_id):
     form = DeleteCommentForm()
     if form.validate_on_submit(): # This validates the CSRF token
@@ -584,29 +2792,113 @@ def delete_comment(comment_id):
         if comment is None:
             conn.close()
             flash("Comment not found.", "danger")
-            return redirect(request.referrer or url_for('feed'))
+            return redirect(request.referrer or url_for('board.feed'))
 
         # Only allow the original commenter to delete
+        conn.close()
         if comment['commenter_anon_id'] != g.anon_id:
-            conn.close()
             flash("You do not have permission to delete this comment.", "danger")
-            return redirect(request.referrer or url_for('post_detail', post_id=comment['post_id']))
+            return redirect(request.referrer or url_for('board.post_detail', post_id=comment['post_id']))
 
         try:
-            # Database CASCADE deletes should handle comment votes automatically
-            conn.execute("DELETE FROM comments WHERE id = ?", (comment_id,))
-            conn.commit()
+            # Replies go with the comment; database CASCADE deletes handle the comment votes
+            db_writer.run(delete_comment_row, comment_id,
+                          on_commit=lambda removed: ranked_index.adjust_comments(comment['post_id'], -removed))
             flash("Comment deleted successfully!", "success")
         except Exception as e:
-            conn.rollback()
             flash(f"Error deleting comment: {str(e)}", "danger")
-        finally:
-            conn.close()
     else:
         flash("CSRF token missing or invalid when deleting comment.", "danger")
-    return redirect(request.referrer or url_for('feed')) # Redirect back to the page they came from
+    return redirect(request.referrer or url_for('board.feed')) # Redirect back to the page they came from
+
+def apply_vote(conn, item_type, item_id, anon_id, vote_type):
+    """
+    Write job: toggles or switches anon_id's vote on a post or comment and updates the sigma totals.
+    Returns None if the item does not exist, otherwise a dict describing the outcome for the caller to emit.
+    """
+    cursor = conn.cursor()
+
+    new_sigma = 0
+    user_vote_status_after_action = 'none'
+    poster_anon_id = None
+    sigma_change = 0
+
+    if item_type == 'post':
+        cursor.execute('SELECT sigma, original_poster_anon_id FROM posts WHERE id = ?', (item_id,))
+        item_row = cursor.fetchone()
+        if item_row is None:
+            return None
+        current_sigma = item_row['sigma']
+        poster_anon_id = item_row['original_poster_anon_id']
+        post_id = item_id
+
+        cursor.execute('SELECT type FROM votes WHERE post_id = ? AND voter_anon_id = ?', (item_id, anon_id))
+        current_vote_row = cursor.fetchone()
+
+        if current_vote_row:
+            old_vote_type = current_vote_row['type']
+            if old_vote_type == vote_type:
+                cursor.execute('DELETE FROM votes WHERE post_id = ? AND voter_anon_id = ?', (item_id, anon_id))
+                sigma_change = -1 if vote_type == 'up' else 1
+                user_vote_status_after_action = 'none'
+            else:
+                cursor.execute('UPDATE votes SET type = ? WHERE post_id = ? AND voter_anon_id = ?', (vote_type, item_id, anon_id))
+                sigma_change = 2 if vote_type == 'up' else -2
+                user_vote_status_after_action = vote_type
+        else:
+            cursor.execute('INSERT INTO votes (post_id, voter_anon_id, type) VALUES (?, ?, ?)', (item_id, anon_id, vote_type))
+            sigma_change = 1 if vote_type == 'up' else -1
+            user_vote_status_after_action = vote_type
+
+        new_sigma = current_sigma + sigma_change
+        cursor.execute('UPDATE posts SET sigma = ? WHERE id = ?', (new_sigma, item_id))
+
+    elif item_type == 'comment':
+        cursor.execute('SELECT sigma, commenter_anon_id, post_id FROM comments WHERE id = ?', (item_id,))
+        item_row = cursor.fetchone()
+        if item_row is None:
+            return None
+        current_sigma = item_row['sigma']
+        poster_anon_id = item_row['commenter_anon_id']
+        # Needed to emit to the correct room for comment updates on the post detail page
+        post_id = item_row['post_id']
+
+        cursor.execute('SELECT type FROM comment_votes WHERE comment_id = ? AND voter_anon_id = ?', (item_id, anon_id))
+        current_vote_row = cursor.fetchone()
+
+        if current_vote_row:
+            old_vote_type = current_vote_row['type']
+            if old_vote_type == vote_type:
+                cursor.execute('DELETE FROM comment_votes WHERE comment_id = ? AND voter_anon_id = ?', (item_id, anon_id))
+                sigma_change = -1 if vote_type == 'up' else 1
+                user_vote_status_after_action = 'none'
+            else:
+                cursor.execute('UPDATE comment_votes SET type = ? WHERE comment_id = ? AND voter_anon_id = ?', (vote_type, item_id, anon_id))
+                sigma_change = 2 if vote_type == 'up' else -2
+                user_vote_status_after_action = vote_type
+        else:
+            cursor.execute('INSERT INTO comment_votes (comment_id, voter_anon_id, type) VALUES (?, ?, ?)', (item_id, anon_id, vote_type))
+            sigma_change = 1 if vote_type == 'up' else -1
+            user_vote_status_after_action = vote_type
+
+        new_sigma = current_sigma + sigma_change
+        cursor.execute('UPDATE comments SET sigma = ? WHERE id = ?', (new_sigma, item_id))
+
+    cursor.execute('UPDATE users SET total_sigma = total_sigma + ? WHERE anon_id = ?', (sigma_change, poster_anon_id))
+
+    cursor.execute("SELECT total_sigma FROM users WHERE anon_id = ?", (poster_anon_id,))
+    poster_total_sigma = cursor.fetchone()['total_sigma']
 
-@app.route('/vote', methods=['POST'])
+    return {
+        'new_sigma': new_sigma,
+        'sigma_change': sigma_change,
+        'user_vote_status': user_vote_status_after_action,
+        'poster_anon_id': poster_anon_id,
+        'poster_total_sigma': poster_total_sigma,
+        'post_id': post_id,
+    }
+
+@bp.route('/vote', methods=['POST'])
 @csrf.exempt # Exempt this route from CSRF protection for now to test if it fixes the issue
 def handle_vote():
     data = request.get_json()
@@ -624,149 +2916,46 @@ def handle_vote():
     if not anon_id or anon_id == "0000":
         return jsonify(success=False, message="Your anonymous session is invalid for voting. Please try again."), 401
 
-    conn = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        new_sigma = 0
-        user_vote_status_after_action = 'none'
-        poster_anon_id = None
-        sigma_change = 0
-
+    def index_vote(outcome):
+        if outcome is None:
+            return
         if item_type == 'post':
-            cursor.execute('SELECT sigma, original_poster_anon_id FROM posts WHERE id = ?', (item_id,))
-            item_row = cursor.fetchone()
-            if item_row is None:
-                return jsonify(success=False, message="Post not found."), 404
-            current_sigma = item_row['sigma']
-            poster_anon_id = item_row['original_poster_anon_id']
-
-            cursor.execute('SELECT type FROM votes WHERE post_id = ? AND voter_anon_id = ?', (item_id, anon_id))
-            current_vote_row = cursor.fetchone()
-
-            if current_vote_row:
-                old_vote_type = current_vote_row['type']
-                if old_vote_type == vote_type:
-                    cursor.execute('DELETE FROM votes WHERE post_id = ? AND voter_anon_id = ?', (item_id, anon_id))
-                    sigma_change = -1 if vote_type == 'up' else 1
-                    user_vote_status_after_action = 'none'
-                else:
-                    cursor.execute('UPDATE votes SET type = ? WHERE post_id = ? AND voter_anon_id = ?', (vote_type, item_id, anon_id))
-                    sigma_change = 2 if vote_type == 'up' else -2
-                    user_vote_status_after_action = vote_type
-            else:
-                cursor.execute('INSERT INTO votes (post_id, voter_anon_id, type) VALUES (?, ?, ?)', (item_id, anon_id, vote_type))
-                sigma_change = 1 if vote_type == 'up' else -1
-                user_vote_status_after_action = vote_type
-
-            new_sigma = current_sigma + sigma_change
-            cursor.execute('UPDATE posts SET sigma = ? WHERE id = ?', (new_sigma, item_id))
-
-        elif item_type == 'comment':
-            cursor.execute('SELECT sigma, commenter_anon_id FROM comments WHERE id = ?', (item_id,))
-            item_row = cursor.fetchone()
-            if item_row is None:
-                return jsonify(success=False, message="Comment not found."), 404
-            current_sigma = item_row['sigma']
-            poster_anon_id = item_row['commenter_anon_id']
-
-            cursor.execute('SELECT type FROM comment_votes WHERE comment_id = ? AND voter_anon_id = ?', (item_id, anon_id))
-            current_vote_row = cursor.fetchone()
-
-            if current_vote_row:
-                old_vote_type = current_vote_row['type']
-                if old_vote_type == vote_type:
-                    cursor.execute('DELETE FROM comment_votes WHERE comment_id = ? AND voter_anon_id = ?', (item_id, anon_id))
-                    sigma_change = -1 if vote_type == 'up' else 1
-                    user_vote_status_after_action = 'none'
-                else:
-                    cursor.execute('UPDATE comment_votes SET type = ? WHERE comment_id = ? AND voter_anon_id = ?', (vote_type, item_id, anon_id))
-                    sigma_change = 2 if vote_type == 'up' else -2
-                    user_vote_status_after_action = vote_type
-            else:
-                cursor.execute('INSERT INTO comment_votes (comment_id, voter_anon_id, type) VALUES (?, ?, ?)', (item_id, anon_id, vote_type))
-                sigma_change = 1 if vote_type == 'up' else -1
-                user_vote_status_after_action = vote_type
-
-            new_sigma = current_sigma + sigma_change
-            cursor.execute('UPDATE comments SET sigma = ? WHERE id = ?', (new_sigma, item_id))
-
-        cursor.execute('UPDATE users SET total_sigma = total_sigma + ? WHERE anon_id = ?', (sigma_change, poster_anon_id))
-        conn.commit()
+            ranked_index.update(item_id, sigma=outcome['new_sigma'])
+            record_trending_vote(item_id, outcome['sigma_change'])
+        outcome['leaderboard_periods'] = record_leaderboard_vote(outcome['poster_anon_id'], outcome['poster_total_sigma'], outcome['sigma_change'])
 
-        cursor.execute("SELECT total_sigma FROM users WHERE anon_id = ?", (poster_anon_id,))
-        updated_total_sigma_for_poster = cursor.fetchone()['total_sigma']
+    try:
+        outcome = db_writer.run(apply_vote, item_type, item_id, anon_id, vote_type, on_commit=index_vote)
+        if outcome is None:
+            return jsonify(success=False, message=f"{item_type.capitalize()} not found."), 404
+        metrics.inc('anonboard_votes_total', item_type=item_type, vote_type=vote_type)
 
-        socketio.emit('update_sigma', {'anon_id': poster_anon_id, 'new_sigma': updated_total_sigma_for_poster})
+        emit_event('update_sigma', {'anon_id': outcome['poster_anon_id'], 'new_sigma': outcome['poster_total_sigma']})
 
         if item_type == 'post':
-            socketio.emit('update_post_sigma', {'post_id': item_id, 'new_sigma': new_sigma})
+            emit_event('update_post_sigma', {'post_id': item_id, 'new_sigma': outcome['new_sigma']})
         elif item_type == 'comment':
-            # Need to get post_id to emit to the correct room for comment updates on post detail page
-            cursor.execute("SELECT post_id FROM comments WHERE id = ?", (item_id,))
-            post_id_for_comment_update = cursor.fetchone()['post_id']
-            socketio.emit('update_comment_sigma', {'comment_id': item_id, 'new_sigma': new_sigma, 'post_id': post_id_for_comment_update})
+            emit_event('update_comment_sigma', {'comment_id': item_id, 'new_sigma': outcome['new_sigma'], 'post_id': outcome['post_id']})
+        emit_leaderboard_updates(outcome.get('leaderboard_periods', ())) # Missing if the on_commit callback failed
 
-        return jsonify(success=True, new_score=new_sigma, user_vote_status=user_vote_status_after_action)
+        return jsonify(success=True, new_score=outcome['new_sigma'], user_vote_status=outcome['user_vote_status'])
 
     except sqlite3.Error as se:
-        if conn:
-            conn.rollback()
         print(f"Database error during voting: {se}", file=sys.stderr)
         return jsonify(success=False, message=f"Database error: {se}"), 500
     except Exception as e:
-        if conn:
-            conn.rollback()
         print(f"An unexpected error occurred during vote: {e}", file=sys.stderr)
         return jsonify({'success': False, 'message': f'An error occurred: {e}'}), 500
-    finally:
-        if conn:
-            conn.close()
 
-@app.route("/photos")
+@bp.route("/photos")
 def photos():
     sort = request.args.get("sort", "hottest")
     view = request.args.get("view", "grid")
     search_query = request.args.get("q", "").strip()
 
-    query = "SELECT p.id, p.username, p.content, p.image_filename, p.created, p.sigma, p.original_poster_anon_id, p.title FROM posts p WHERE p.image_filename IS NOT NULL AND p.image_filename != ''"
-    filters = []
-    params = []
-
-    if search_query:
-        filters.append("(p.username LIKE ? OR p.content LIKE ? OR p.title LIKE ?)")
-        params.extend([f'%{search_query}%', f'%{search_query}%', f'%{search_query}%'])
-
-    if filters:
-        query += " AND " + " AND ".join(filters)
-
-    if sort == "hottest":
-        query += " ORDER BY p.sigma DESC"
-    elif sort == "latest":
-        query += " ORDER BY p.created DESC"
-    else:
-        query += " ORDER BY p.sigma DESC"
-
-    posts_data = []
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        fetched_posts = cursor.fetchall()
-
+    def format_chunk(conn, fetched_posts):
+        user_votes = fetch_user_post_votes(conn, g.anon_id, [row['id'] for row in fetched_posts])
         for post_row in fetched_posts:
-            post_id = post_row['id']
-            user_vote_type = None
-            if g.anon_id != "0000":
-                cursor.execute("SELECT type FROM votes WHERE post_id = ? AND voter_anon_id = ?", (post_id, g.anon_id))
-                vote_row = cursor.fetchone()
-                if vote_row:
-                    user_vote_type = vote_row['type']
-
-            cursor.execute("SELECT COUNT(*) FROM comments WHERE post_id = ?", (post_id,))
-            total_comments = cursor.fetchone()[0]
-
             # post: [id, username, content, image_filename, created, sigma, original_poster_anon_id, user_vote_status, total_comments, title]
             post_list = [
                 post_row['id'],
@@ -776,23 +2965,19 @@ def photos():
                 post_row['created'],
                 post_row['sigma'],
                 post_row['original_poster_anon_id'],
-                user_vote_type,
-                total_comments,
+                user_votes.get(post_row['id']),
+                post_row['total_comments'],
                 post_row['title']
             ]
-            posts_data.append(tuple(post_list))
+            yield tuple(post_list)
 
-    except Exception as e:
-        flash(f"Error loading photos: {str(e)}", "danger")
-        posts_data = []
-    finally:
-        conn.close()
+    posts = ListingPage('photos', sort, search_query, format_chunk, limit=current_app.config['LISTING_PAGE_SIZE'])
 
     delete_post_form = DeletePostForm() # For delete buttons in photos view
 
-    return render_template(
+    return stream_listing_template(
         "photos.html",
-        posts=posts_data,
+        posts=posts,
         anon_id=g.anon_id,
         join_date=g.join_date,
         sigma_score=g.sigma_score,
@@ -806,45 +2991,22 @@ def photos():
     )
 
 # app.py snippet for /text_discussions route
-@app.route("/text")
+@bp.route("/text")
 def text_discussions():
     sort = request.args.get("sort", "best")
     view = request.args.get("view", "card")
     search_query = request.args.get("q", "").strip()
 
-    query = "SELECT p.id, p.username, p.content, p.image_filename, p.created, p.sigma, p.original_poster_anon_id, p.title FROM posts p WHERE p.image_filename IS NULL OR p.image_filename = ''"
-    filters = []
-    params = []
-
-    if search_query:
-        filters.append("(p.username LIKE ? OR p.content LIKE ? OR p.title LIKE ?)")
-        params.extend([f'%{search_query}%', f'%{search_query}%', f'%{search_query}%'])
-
-    if filters:
-        query += " AND " + " AND ".join(filters)
-
-    if sort == "hottest":
-        query += " ORDER BY p.sigma DESC"
-    elif sort == "best":
-        query += " ORDER BY (SELECT COUNT(*) FROM comments c WHERE c.post_id = p.id) DESC"
-    else:
-        query += " ORDER BY p.created DESC"
-
-    posts_data = []
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        fetched_posts = cursor.fetchall()
+    def format_chunk(conn, fetched_posts):
+        post_ids = [row['id'] for row in fetched_posts]
+        latest_comments = fetch_latest_comments(conn, post_ids)
+        user_votes = fetch_user_post_votes(conn, g.anon_id, post_ids)
 
         for post_row in fetched_posts:
             post_id = post_row['id']
 
-            cursor.execute("SELECT id, commenter_anon_id, content, created, sigma FROM comments WHERE post_id = ? ORDER BY created DESC LIMIT 2", (post_id,))
-            comments = cursor.fetchall()
-
             formatted_comments = []
-            for comment_row in comments:
+            for comment_row in latest_comments.get(post_id, []):
                 # comment_list structure: [id, commenter_anon_id, content, sigma, user_comment_vote_type, created]
                 comment_list = [
                     comment_row['id'],
@@ -856,16 +3018,6 @@ def text_discussions():
                 ]
                 formatted_comments.append(tuple(comment_list))
 
-            cursor.execute("SELECT COUNT(*) FROM comments WHERE post_id = ?", (post_id,))
-            total_comments = cursor.fetchone()[0]
-
-            user_vote_type = None
-            if g.anon_id != "0000":
-                cursor.execute("SELECT type FROM votes WHERE post_id = ? AND voter_anon_id = ?", (post_id, g.anon_id))
-                vote_row = cursor.fetchone()
-                if vote_row:
-                    user_vote_type = vote_row['type']
-
             # post_list structure for /text_discussions:
             # Aligned with the provided Jinja2 snippet's current indices to minimize template changes
             # [0] id
@@ -887,15 +3039,12 @@ def text_discussions():
                 post_row['sigma'],              # Corresponds to post[5] in your Jinja2
                 post_row['original_poster_anon_id'], # Corresponds to post[6] in your Jinja2 (Anon ID)
                 formatted_comments,             # Corresponds to post[7] in your Jinja2
-                total_comments,                 # Corresponds to post[8] in your Jinja2
-                user_vote_type                  # Corresponds to post[9] in your Jinja2
+                post_row['total_comments'],     # Corresponds to post[8] in your Jinja2
+                user_votes.get(post_id)         # Corresponds to post[9] in your Jinja2
             ]
-            posts_data.append(tuple(post_list))
-    except Exception as e:
-        flash(f"Error loading threads: {str(e)}", "danger")
-        posts_data = []
-    finally:
-        conn.close()
+            yield tuple(post_list)
+
+    posts = ListingPage('text', sort, search_query, format_chunk, limit=current_app.config['LISTING_PAGE_SIZE'])
 
     # Ensure DeletePostForm is instantiated and passed to the template
     # You might need to import DeletePostForm if not already done:
@@ -910,9 +3059,9 @@ def text_discussions():
 
     delete_post_form = DeletePostForm() # Instantiate the form
 
-    return render_template(
+    return stream_listing_template(
         "text.html",
-        posts=posts_data,
+        posts=posts,
         anon_id=g.anon_id,
         join_date=g.join_date,
         sigma_score=g.sigma_score,
@@ -926,13 +3075,13 @@ def text_discussions():
     )
             
 
-@app.route("/upload_image", methods=["POST"])
+@bp.route("/upload_image", methods=["POST"])
 def upload_image():
     anon_id = g.anon_id
 
     if 'image_file' not in request.files:
         flash('No file part', 'danger')
-        return redirect(url_for('upload_form'))
+        return redirect(url_for('board.upload_form'))
 
     file = request.files['image_file']
     title = request.form.get('title', '').strip()
@@ -940,48 +3089,42 @@ def upload_image():
 
     if file.filename == '':
         flash('No selected file', 'danger')
-        return redirect(url_for('upload_form'))
+        return redirect(url_for('board.upload_form'))
 
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         unique_filename = f"{anon_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{filename}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
 
         file_size = len(file.read()) # Read file size *before* saving
         file.seek(0) # Reset file pointer after reading size
-        if file_size > app.config['MAX_CONTENT_LENGTH']:
-            flash(f'File size exceeds limit of {app.config["MAX_CONTENT_LENGTH"] / (1024 * 1024):.0f} MB.', 'warning')
-            return redirect(url_for('upload_form'))
+        if file_size > current_app.config['MAX_CONTENT_LENGTH']:
+            flash(f'File size exceeds limit of {current_app.config["MAX_CONTENT_LENGTH"] / (1024 * 1024):.0f} MB.', 'warning')
+            return redirect(url_for('board.upload_form'))
 
         file.save(file_path)
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute(
-                "INSERT INTO posts (username, content, image_filename, created, sigma, original_poster_anon_id, title) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (f"Anon{anon_id}", description, unique_filename, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 0, anon_id, title)
-            )
-            conn.commit()
+            created = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            db_writer.run(insert_post, anon_id, title, description, unique_filename, created,
+                          on_commit=lambda new_post_id: ranked_index.add_post(new_post_id, unique_filename, created))
+            metrics.inc('anonboard_posts_created_total', kind='photo')
             flash('Image uploaded successfully!', 'success')
-            return redirect(url_for('photos'))
-        except sqlite3.Error as e:
-            conn.rollback()
+            return redirect(url_for('board.photos'))
+        except Exception as e:
             flash(f"Database error: {e}", "danger")
             if os.path.exists(file_path):
                 os.remove(file_path)
-            return redirect(url_for('upload_form'))
-        finally:
-            conn.close()
+            return redirect(url_for('board.upload_form'))
     else:
         flash('Invalid file type. Allowed types are png, jpg, jpeg, gif, mp4, webm, ogg.', 'danger')
-        return redirect(url_for('upload_form'))
+        return redirect(url_for('board.upload_form'))
 
-@app.route('/uploads/<filename>')
+@bp.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
 
-@app.route("/create_thread_post", methods=['GET', 'POST'])
+@bp.route("/create_thread_post", methods=['GET', 'POST'])
 def create_thread_post():
     anon_id = g.anon_id
 
@@ -989,37 +3132,258 @@ def create_thread_post():
     if form.validate_on_submit():
         title = form.title.data
         content = form.content.data
-        username = f"Anon{anon_id}"
 
         if not content and not title:
             flash("Thread post must contain a title or body content.", 'warning')
             return render_template('post.html', form=form)
 
-        conn = get_db_connection()
         try:
             current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            conn.execute('''
-                INSERT INTO posts (username, content, title, image_filename, created, sigma, original_poster_anon_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (username, content, title, None, current_time, 0, anon_id))
-            conn.commit()
+            db_writer.run(insert_post, anon_id, title, content, None, current_time,
+                          on_commit=lambda new_post_id: ranked_index.add_post(new_post_id, None, current_time))
+            metrics.inc('anonboard_posts_created_total', kind='text')
             flash("Thread post created successfully!", 'success')
-            return redirect(url_for('text_discussions'))
+            return redirect(url_for('board.text_discussions'))
         except Exception as e:
             flash(f"Error creating thread post: {str(e)}", 'danger')
             return render_template('post.html', form=form)
-        finally:
-            conn.close()
-
     return render_template("post.html",
                            form=form,
                            anon_id=anon_id,
                            join_date=g.join_date,
                            sigma_score=g.sigma_score)
 
+@bp.route("/leaderboard")
+def leaderboard_page():
+    period = request.args.get("period", "all")
+    if period not in LEADERBOARD_PERIODS:
+        period = "all"
+
+    return render_template(
+        "leaderboard.html",
+        entries=leaderboard.top(period),
+        period=period,
+        anon_id=g.anon_id,
+        join_date=g.join_date,
+        sigma_score=g.sigma_score
+    )
+
+# --- JSON API (read-only, cursor-paginated) ---
+POST_API_FIELDS = (
+    'id', 'username', 'title', 'content', 'image_filename', 'image_url', 'is_video', 'created',
+    'created_ago', 'sigma', 'original_poster_anon_id', 'total_comments', 'user_vote', 'latest_comments'
+)
+COMMENT_API_FIELDS = (
+    'id', 'commenter_anon_id', 'content', 'created', 'created_ago', 'sigma', 'user_vote',
+    'parent_id', 'depth', 'reply_count'
+)
+
+def api_error(message, status):
+    return jsonify(success=False, message=message), status
+
+def api_requested_fields(allowed):
+    """Parses ?fields=a,b,c into a tuple of field names; None means every field."""
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    requested = tuple(f.strip() for f in fields.split(',') if f.strip())
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+def api_page_size(default):
+    limit = request.args.get('limit', default, type=int)
+    return max(1, min(limit, current_app.config['API_MAX_PAGE_SIZE']))
+
+def select_fields(item, fields):
+    if fields is None:
+        return item
+    return {name: item[name] for name in fields if name in item}
+
+def serialize_comment(row, user_vote=None):
+    return {
+        'id': row['id'],
+        'commenter_anon_id': row['commenter_anon_id'],
+        'content': row['content'],
+        'created': row['created'],
+        'created_ago': format_time_ago_filter(row['created']),
+        'sigma': row['sigma'] or 0,
+        'user_vote': user_vote,
+        'parent_id': row['parent_id'],
+        'depth': row['depth'],
+        'reply_count': row['reply_count'] or 0,
+    }
+
+def serialize_post(row, user_vote=None, latest_comments=None):
+    image_filename = row['image_filename']
+    item = {
+        'id': row['id'],
+        'username': row['username'],
+        'title': row['title'],
+        'content': row['content'],
+        'image_filename': image_filename,
+        'image_url': url_for('board.uploaded_file', filename=image_filename) if image_filename else None,
+        'is_video': bool(image_filename) and image_filename.rsplit('.', 1)[-1].lower() in ('mp4', 'webm', 'ogg'),
+        'created': row['created'],
+        'created_ago': format_time_ago_filter(row['created']),
+        'sigma': row['sigma'] or 0,
+        'original_poster_anon_id': row['original_poster_anon_id'],
+        'total_comments': row['total_comments'],
+        'user_vote': user_vote,
+    }
+    if latest_comments is not None:
+        item['latest_comments'] = [serialize_comment(c) for c in latest_comments]
+    return item
+
+def api_listing(kind, default_sort):
+    sort = request.args.get("sort", default_sort)
+    search_query = request.args.get("q", "").strip()
+    try:
+        fields = api_requested_fields(POST_API_FIELDS)
+    except ValueError as e:
+        return api_error(str(e), 400)
+    limit = api_page_size(current_app.config['LISTING_PAGE_SIZE'])
+
+    conn = get_db_connection()
+    try:
+        rows, next_cursor = fetch_listing_page(conn, kind, sort, search_query, request.args.get('cursor'), limit)
+        post_ids = [row['id'] for row in rows]
+        user_votes = fetch_user_post_votes(conn, g.anon_id, post_ids) if fields is None or 'user_vote' in fields else {}
+        latest = None
+        if kind == 'text' and (fields is None or 'latest_comments' in fields):
+            latest = fetch_latest_comments(conn, post_ids)
+    except InvalidCursor:
+        return api_error("Invalid cursor.", 400)
+    finally:
+        conn.close()
+
+    items = [
+        select_fields(serialize_post(row, user_votes.get(row['id']), latest.get(row['id'], []) if latest is not None else None), fields)
+        for row in rows
+    ]
+    return jsonify(success=True, items=items, next_cursor=next_cursor)
+
+@bp.route('/api/feed')
+def api_feed():
+    return api_listing('all', 'best')
+
+@bp.route('/api/photos')
+def api_photos():
+    return api_listing('photos', 'hottest')
+
+@bp.route('/api/text')
+def api_text_discussions():
+    return api_listing('text', 'best')
+
+@bp.route('/api/post/<int:post_id>')
+def api_post_detail(post_id):
+    try:
+        fields = api_requested_fields(POST_API_FIELDS)
+        comment_fields = None
+        if request.args.get('comment_fields'):
+            comment_fields = tuple(f.strip() for f in request.args['comment_fields'].split(',') if f.strip())
+            unknown = [f for f in comment_fields if f not in COMMENT_API_FIELDS]
+            if unknown:
+                raise ValueError(f"Unknown comment fields: {', '.join(unknown)}")
+    except ValueError as e:
+        return api_error(str(e), 400)
+    limit = api_page_size(50)
+
+    conn = get_post_connection(post_id)
+    try:
+        post_row = conn.execute(f"""
+            SELECT p.id, p.username, p.content, p.image_filename, p.created, p.sigma,
+                   p.original_poster_anon_id, p.title, {COMMENT_COUNT_SQL} AS total_comments
+            FROM posts p WHERE p.id = ?
+        """, (post_id,)).fetchone()
+        if post_row is None:
+            return api_error("Post not found.", 404)
+        post_vote = fetch_user_post_votes(conn, g.anon_id, [post_id]).get(post_id)
+        comment_rows, next_cursor = fetch_comment_page(conn, post_id, request.args.get('cursor'), limit)
+        comment_votes = fetch_user_comment_votes(conn, g.anon_id, [row['id'] for row in comment_rows])
+    except InvalidCursor:
+        return api_error("Invalid cursor.", 400)
+    finally:
+        conn.close()
+
+    return jsonify(
+        success=True,
+        post=select_fields(serialize_post(post_row, post_vote), fields),
+        comments=[select_fields(serialize_comment(row, comment_votes.get(row['id'])), comment_fields) for row in comment_rows],
+        next_cursor=next_cursor
+    )
+
+def serialize_comment_rows(rows, comment_votes, max_depth):
+    """Serializes comments for the threaded views, adding how many replies each has collapsed at the depth cutoff."""
+    comments = []
+    for row in rows:
+        item = serialize_comment(row, comment_votes.get(row['id']))
+        item['collapsed_replies'] = collapsed_replies(row, max_depth)
+        comments.append(item)
+    return comments
+
+@bp.route('/api/post/<int:post_id>/comments')
+def api_comment_threads(post_id):
+    """One page of a post's top-level comments in ?sort= order (top, new, old), each with its first replies."""
+    sort = request.args.get('sort', DEFAULT_COMMENT_SORT)
+    if sort not in COMMENT_SORTS:
+        return api_error(f"Unknown sort: {sort}", 400)
+    limit = api_page_size(current_app.config['COMMENT_PAGE_SIZE'])
+    max_depth = current_app.config['COMMENT_TREE_DEPTH'] - 1
+
+    conn = get_post_connection(post_id)
+    try:
+        threads, next_cursor = fetch_comment_threads(
+            conn, post_id, sort, request.args.get('cursor'), limit,
+            current_app.config['COMMENT_THREAD_REPLIES'], max_depth
+        )
+        comment_votes = fetch_user_comment_votes(conn, g.anon_id, [row['id'] for rows, _ in threads for row in rows])
+    except InvalidCursor:
+        return api_error("Invalid cursor.", 400)
+    finally:
+        conn.close()
+
+    return jsonify(
+        success=True,
+        threads=[
+            {'comments': serialize_comment_rows(rows, comment_votes, max_depth), 'replies_cursor': replies_cursor}
+            for rows, replies_cursor in threads
+        ],
+        next_cursor=next_cursor
+    )
+
+@bp.route('/api/post/<int:post_id>/comments/<int:comment_id>/replies')
+def api_comment_replies(post_id, comment_id):
+    """Replies below a comment in thread order, to the same depth a page of threads shows, cursor-paginated."""
+    limit = api_page_size(current_app.config['COMMENT_THREAD_REPLIES'])
+    conn = get_post_connection(post_id)
+    try:
+        root = conn.execute("SELECT path, depth FROM comments WHERE id = ? AND post_id = ?", (comment_id, post_id)).fetchone()
+        if root is None:
+            return api_error("Comment not found.", 404)
+        max_depth = root['depth'] + current_app.config['COMMENT_TREE_DEPTH'] - 1
+        rows, next_cursor = fetch_comment_replies(conn, post_id, root, max_depth, request.args.get('cursor'), limit)
+        comment_votes = fetch_user_comment_votes(conn, g.anon_id, [row['id'] for row in rows])
+    except InvalidCursor:
+        return api_error("Invalid cursor.", 400)
+    finally:
+        conn.close()
+
+    return jsonify(success=True, comments=serialize_comment_rows(rows, comment_votes, max_depth), next_cursor=next_cursor)
+
+@bp.route('/api/leaderboard')
+def api_leaderboard():
+    period = request.args.get('period', 'all')
+    if period not in LEADERBOARD_PERIODS:
+        return api_error(f"Unknown period: {period}", 400)
+    limit = api_page_size(current_app.config['LEADERBOARD_SIZE'])
+    return jsonify(success=True, period=period, items=leaderboard.top(period, limit))
+
 ## SocketIO Event Handlers
-@socketio.on('connect')
+# Registered on each app's Socket.IO server by create_app(), see SOCKETIO_HANDLERS
 def handle_connect():
+    metrics.inc('anonboard_socketio_connections')
     anon_id = session.get("anon_id")
     if anon_id and anon_id != "0000":
         join_room(anon_id)
@@ -1027,35 +3391,109 @@ def handle_connect():
     else:
         print(f"Client {request.sid} connected without anon_id")
 
-@socketio.on('disconnect')
-def handle_disconnect():
+def handle_join_leaderboard(data):
+    period = (data or {}).get('period')
+    if period in LEADERBOARD_PERIODS:
+        join_room(leaderboard_room(period))
+
+def handle_disconnect(reason=None):
+    metrics.dec('anonboard_socketio_connections')
     anon_id = session.get("anon_id")
     if anon_id and anon_id != "0000":
         leave_room(anon_id)
         print(f"Client {request.sid} left room {anon_id}")
     print("Client disconnected")
 
-@app.route("/upload_form")
+SOCKETIO_HANDLERS = {
+    'connect': handle_connect,
+    'join_leaderboard': handle_join_leaderboard,
+    'disconnect': handle_disconnect,
+}
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    response = make_response(metrics.render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+@bp.route('/admin/profiles')
+def list_profiles():
+    if not is_admin_request():
+        return jsonify(success=False, message="Not found."), 404
+    profile_dir = current_app.config['PROFILE_DIR']
+    profiles = []
+    if os.path.isdir(profile_dir):
+        for name in sorted(os.listdir(profile_dir), reverse=True):
+            path = os.path.join(profile_dir, name)
+            profiles.append({
+                'name': name,
+                'size': os.path.getsize(path),
+                'url': url_for('board.download_profile', filename=name)
+            })
+    return jsonify(success=True, profiles=profiles)
+
+@bp.route('/admin/profiles/<filename>')
+def download_profile(filename):
+    if not is_admin_request():
+        return jsonify(success=False, message="Not found."), 404
+    return send_from_directory(os.path.abspath(current_app.config['PROFILE_DIR']), filename, as_attachment=True)
+
+@bp.route("/upload_form")
 def upload_form():
     return render_template("upload_form.html",
                            anon_id=g.anon_id,
                            join_date=g.join_date,
                            sigma_score=g.sigma_score)
 
-@app.route('/')
+@bp.route('/')
 def index():
-    upload_url = url_for('upload_form')
-    add_comment_example_url = url_for('post_detail', post_id=1)
+    upload_url = url_for('board.upload_form')
+    add_comment_example_url = url_for('board.post_detail', post_id=1)
     return f"""
     <p>Go to <a href="{upload_url}">Upload Page</a></p>
     <p>Visit a post detail page to add comments (e.g., <a href="{add_comment_example_url}">Post 1 Detail</a>)</p>
-    <p>Visit <a href="{url_for('feed')}">Feed</a></p>
-    <p>Visit <a href="{url_for('photos')}">Photos</a></p>
-    <p>Visit <a href="{url_for('text_discussions')}">Text Discussions</a></p>
-    <p>Visit <a href="{url_for('create_post')}">Create Post (Unified)</a></p>
-    <p>Visit <a href="{url_for('create_thread_post')}">Create Thread Post (Specific to Text)</a></p>
+    <p>Visit <a href="{url_for('board.feed')}">Feed</a></p>
+    <p>Visit <a href="{url_for('board.photos')}">Photos</a></p>
+    <p>Visit <a href="{url_for('board.text_discussions')}">Text Discussions</a></p>
+    <p>Visit <a href="{url_for('board.create_post')}">Create Post (Unified)</a></p>
+    <p>Visit <a href="{url_for('board.create_thread_post')}">Create Thread Post (Specific to Text)</a></p>
+    """
+
+# --- Application Factory ---
+# Worker processes, tests and benchmarks each call create_app() with their own settings. The flask CLI
+# finds it on its own (`flask --app app init-db`); for gunicorn, use `gunicorn "app:create_app()"`.
+def create_app(config=None):
+    """
+    Builds an app from DEFAULT_CONFIG overridden by config (e.g. DATABASE, ARCHIVE_DATABASE,
+    UPLOAD_FOLDER, SOCKETIO_OPTIONS). Each app has its own writer thread, in-memory indexes, rate
+    limiter and Socket.IO server, so several can run side by side in one process. Does no I/O;
+    see ensure_initialized().
     """
+    app = Flask(__name__)
+    app.config.update(copy.deepcopy(DEFAULT_CONFIG))
+    app.config.update(config or {})
+    if app.config['TRUSTED_PROXIES']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+
+    app.extensions['anonboard'] = {
+        'db_writer': DatabaseWriter(app),
+        'trending': TrendingCounters(),
+        'ranked_index': RankedIndex(),
+        'leaderboard': Leaderboard(),
+        'rate_limiter': TokenBuckets(app.config['RATE_LIMIT_MAX_KEYS']),
+        'maintenance': MaintenanceScheduler(app),
+        'asset_manifest': {},
+        'initialized': threading.Event(),
+        'init_lock': threading.Lock(),
+    }
+    csrf.init_app(app)
+    server = SocketIO(app, **app.config['SOCKETIO_OPTIONS'])
+    for event, handler in SOCKETIO_HANDLERS.items():
+        server.on_event(event, handler)
+    app.register_blueprint(bp)
+    return app
 
 # Run the app with SocketIO
 if __name__ == '__main__':
-    socketio.run(app, debug=True)
\ No newline at end of file
+    app = create_app()
+    app.extensions['socketio'].run(app, debug=True)
@@ -0,0 +1,564 @@
+// Shared client code for the listing pages (feed.html, photos.html, text.html, leaderboard.html); the post pages build on it too.
+// Page-specific values (anon_id, CSRF token) are read from data attributes on <body>,
+// so this file has no template variables and can be cached forever under its hashed name.
+(function () {
+    'use strict';
+
+    const AnonBoard = {};
+
+    function escapeHtml(value) {
+        return String(value ?? '').replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c]));
+    }
+
+    function anonName(anonId) {
+        return String(anonId).padStart(4, '0');
+    }
+
+    function pageContext() {
+        return {
+            anonId: document.body.dataset.anonId || '',
+            csrfToken: document.body.dataset.csrfToken || ''
+        };
+    }
+
+    // --- Theme ---
+    function initThemeToggle() {
+        const themeToggleBtn = document.getElementById('themeToggle');
+
+        function applyTheme(isLightMode) {
+            document.body.classList.toggle('light-mode', isLightMode);
+            themeToggleBtn.innerHTML = isLightMode ? '🌙 Dark Mode' : '☀️ Light Mode';
+        }
+
+        applyTheme(localStorage.getItem('theme') === 'light');
+
+        themeToggleBtn.addEventListener('click', () => {
+            const isLight = document.body.classList.contains('light-mode');
+            applyTheme(!isLight);
+            localStorage.setItem('theme', isLight ? 'dark' : 'light');
+        });
+    }
+
+    // --- Markdown ---
+    // Lightweight renderer used by the feed and photo pages (bold, italic, links)
+    function renderSimpleMarkdown(root, selector) {
+        root.querySelectorAll(selector).forEach(element => {
+            const markdownContent = element.getAttribute('data-markdown-content');
+            if (markdownContent) {
+                element.innerHTML = markdownContent
+                    .replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>') // Bold
+                    .replace(/\*(.*?)\*/g, '<em>$1</em>') // Italic
+                    .replace(/\[(.*?)\]\((.*?)\)/g, '<a href="$2" target="_blank">$1</a>'); // Links
+            }
+        });
+    }
+
+    // marked.js over the elements' own text, used by the post pages
+    function renderMarkdownText(root, selector) {
+        root.querySelectorAll(selector).forEach(element => {
+            const markdownContent = element.textContent;
+            if (markdownContent) {
+                element.innerHTML = marked.parse(markdownContent);
+            }
+        });
+    }
+
+    // Full renderer (marked.js) used by the thread discussions page
+    function renderMarkedMarkdown(root) {
+        root.querySelectorAll('.post-title-rendered').forEach(element => {
+            const markdownContent = element.dataset.markdownContent;
+            if (markdownContent) {
+                element.innerHTML = marked.parse(markdownContent);
+                if (element.children.length === 1 && element.children[0].tagName === 'P') {
+                    element.innerHTML = element.children[0].innerHTML;
+                }
+            }
+        });
+
+        root.querySelectorAll('.post-body-rendered, .comment-content-rendered').forEach(element => {
+            const markdownContent = element.dataset.markdownContent;
+            if (markdownContent) {
+                element.innerHTML = marked.parse(markdownContent);
+            }
+        });
+    }
+
+    // --- Voting ---
+    function postVote(itemType, itemId, voteType) {
+        return fetch('/vote', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ item_type: itemType, [itemType + '_id']: parseInt(itemId, 10), vote_type: voteType })
+        }).then(response => response.json().then(data => {
+            if (!response.ok && data.success === undefined) {
+                throw new Error(data.message || 'Server error');
+            }
+            return data;
+        }));
+    }
+
+    // --- Search ---
+    function initSearch(defaultSort, defaultView) {
+        const mainSearchInput = document.getElementById('mainSearchInput');
+        if (!mainSearchInput) return;
+
+        mainSearchInput.addEventListener('keypress', function (event) {
+            if (event.key === 'Enter') {
+                event.preventDefault();
+                const currentUrl = new URL(window.location.href);
+                const searchValue = this.value.trim();
+                if (searchValue) {
+                    currentUrl.searchParams.set('q', searchValue);
+                } else {
+                    currentUrl.searchParams.delete('q');
+                }
+                currentUrl.searchParams.set('sort', currentUrl.searchParams.get('sort') || defaultSort);
+                currentUrl.searchParams.set('view', currentUrl.searchParams.get('view') || defaultView);
+                window.location.href = currentUrl.toString();
+            }
+        });
+    }
+
+    // --- Infinite Scroll ---
+    // Fetches further pages from the JSON API named in #post-list[data-api-url] and appends rendered cards.
+    // The cursor lives on the sentinel because the server only knows it once the streamed list has been rendered.
+    function initInfiniteScroll(label, renderItem, enhance) {
+        const postList = document.getElementById('post-list');
+        const sentinel = document.getElementById('load-more-sentinel');
+        if (!postList || !sentinel || !sentinel.dataset.nextCursor) return;
+        let loadingMore = false;
+
+        function loadMore() {
+            const cursor = sentinel.dataset.nextCursor;
+            if (loadingMore || !cursor) return;
+            loadingMore = true;
+            sentinel.textContent = `Loading more ${label}...`;
+            const url = new URL(postList.dataset.apiUrl, window.location.origin);
+            url.searchParams.set('cursor', cursor);
+            fetch(url)
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.success) throw new Error(data.message);
+                    const newCards = document.createElement('div');
+                    data.items.forEach(item => newCards.appendChild(renderItem(item)));
+                    enhance(newCards);
+                    while (newCards.firstChild) postList.appendChild(newCards.firstChild);
+                    sentinel.dataset.nextCursor = data.next_cursor || '';
+                    sentinel.textContent = data.next_cursor ? '' : 'You have reached the end.';
+                })
+                .catch(error => {
+                    console.error(`Error loading more ${label}:`, error);
+                    sentinel.textContent = `Could not load more ${label}.`;
+                })
+                .finally(() => { loadingMore = false; });
+        }
+
+        new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadMore();
+        }, { rootMargin: '600px' }).observe(sentinel);
+    }
+
+    // --- Feed page ---
+    function bindFeedVoteButtons(root) {
+        root.querySelectorAll('.vote-btn').forEach(button => {
+            button.addEventListener('click', function (event) {
+                event.stopPropagation(); // Prevent card click event from firing
+
+                const postId = this.dataset.postId;
+                const voteType = this.dataset.voteType; // 'up' or 'down'
+                const parentControls = this.closest('.vote-button-group');
+                const currentUpvoteBtn = parentControls.querySelector('.vote-btn.upvote, .vote-btn.like-btn'); // Get either upvote arrow or like heart
+                const currentDownvoteBtn = parentControls.querySelector('.vote-btn.downvote'); // This will be null for image posts
+                const scoreSpan = parentControls.querySelector('.sigma-score');
+
+                let currentVoteStatus = null;
+                if (currentUpvoteBtn && currentUpvoteBtn.classList.contains('active')) {
+                    currentVoteStatus = 'up';
+                } else if (currentDownvoteBtn && currentDownvoteBtn.classList.contains('active')) {
+                    currentVoteStatus = 'down';
+                }
+
+                let newVoteToSend = voteType;
+                if (currentVoteStatus === voteType) {
+                    newVoteToSend = 'none'; // User clicked active vote button, so remove vote
+                }
+
+                postVote('post', postId, newVoteToSend)
+                    .then(data => {
+                        if (data.success) {
+                            scoreSpan.textContent = data.new_score;
+                            // Reset active state for all vote buttons in this group
+                            if (currentUpvoteBtn) currentUpvoteBtn.classList.remove('active');
+                            if (currentDownvoteBtn) currentDownvoteBtn.classList.remove('active');
+
+                            if (data.user_vote_status === 'up') {
+                                if (currentUpvoteBtn) currentUpvoteBtn.classList.add('active');
+                            } else if (data.user_vote_status === 'down') {
+                                if (currentDownvoteBtn) currentDownvoteBtn.classList.add('active');
+                            }
+                        } else {
+                            alert('Error updating vote: ' + data.message);
+                            console.error('Vote failed (server reported failure):', data.message);
+                        }
+                    })
+                    .catch(error => {
+                        console.error('Fetch error during vote:', error);
+                        alert('An error occurred while voting.');
+                    });
+            });
+        });
+    }
+
+    function renderFeedCard(post) {
+        const { anonId, csrfToken } = pageContext();
+        const compactView = document.getElementById('post-list').dataset.view === 'compact';
+        const id = post.id;
+        const voteControls = post.image_filename
+            ? `<button type="button" class="vote-btn like-btn ${post.user_vote === 'up' ? 'active' : ''}" data-post-id="${id}" data-vote-type="up" onclick="event.stopPropagation();"><i class="fas fa-heart"></i></button>
+               <span class="sigma-score" id="score-${id}">${post.sigma}</span>`
+            : `<button type="button" class="vote-btn upvote ${post.user_vote === 'up' ? 'active' : ''}" data-post-id="${id}" data-vote-type="up" onclick="event.stopPropagation();"><i class="fas fa-arrow-up"></i></button>
+               <span class="sigma-score" id="score-${id}">${post.sigma}</span>
+               <button type="button" class="vote-btn downvote ${post.user_vote === 'down' ? 'active' : ''}" data-post-id="${id}" data-vote-type="down" onclick="event.stopPropagation();"><i class="fas fa-arrow-down"></i></button>`;
+        const deleteForm = post.original_poster_anon_id === anonId
+            ? `<form action="/delete_post/${id}" method="POST" style="display:inline;" onsubmit="return confirm('Are you sure you want to delete this post?');" class="delete-form">
+                   <input type="hidden" name="csrf_token" value="${escapeHtml(csrfToken)}">
+                   <button type="submit" class="btn-action delete" title="Delete Post" onclick="event.stopPropagation();"><i class="fas fa-trash-alt"></i></button>
+               </form>`
+            : '';
+        let media = '';
+        if (post.image_filename) {
+            const extension = post.image_filename.split('.').pop();
+            media = post.is_video
+                ? `<video controls class="img-fluid rounded" style="max-height: 400px; object-fit: contain;"><source src="${escapeHtml(post.image_url)}" type="video/${escapeHtml(extension)}">Your browser does not support the video tag.</video>`
+                : `<img src="${escapeHtml(post.image_url)}" class="img-fluid rounded" alt="Post Image" style="max-height: 400px; object-fit: contain;">`;
+            media = `<div class="post-image mt-3 text-center">${media}</div>`;
+        }
+        const card = document.createElement('div');
+        card.className = `post-card ${compactView ? 'compact-view' : ''}`;
+        card.dataset.postId = id;
+        card.addEventListener('click', () => { window.location.href = `/post/${id}`; });
+        card.innerHTML = `
+            <div class="vote-controls"><div class="vote-button-group" data-post-id="${id}">${voteControls}</div></div>
+            <div class="post-content-container">
+                <div class="post-header">
+                    <strong class="post-username">${escapeHtml(post.username)}</strong>
+                    <span class="text-muted small"> • ${escapeHtml(post.created)}</span>
+                    <div class="post-actions">
+                        <a href="/post/${id}" class="btn-action comment-link" onclick="event.stopPropagation();"><i class="fas fa-comment"></i> </a>
+                        ${deleteForm}
+                    </div>
+                </div>
+                ${post.title ? `<div class="post-title-rendered" data-markdown-content="${escapeHtml(post.title)}"><h2>${escapeHtml(post.title)}</h2></div>` : ''}
+                ${post.content ? `<div class="post-body-rendered" data-markdown-content="${escapeHtml(post.content)}"><p>${escapeHtml(post.content)}</p></div>` : ''}
+                ${media}
+            </div>`;
+        return card;
+    }
+
+    AnonBoard.initFeedPage = function () {
+        const enhance = root => {
+            renderSimpleMarkdown(root, '.post-title-rendered, .post-body-rendered, .comment-content-rendered');
+            bindFeedVoteButtons(root);
+        };
+        initThemeToggle();
+        enhance(document);
+        initInfiniteScroll('posts', renderFeedCard, enhance);
+        initSearch('latest', 'full');
+    };
+
+    // --- Photos page ---
+    function bindPhotoLikeButtons(root) {
+        root.querySelectorAll('.btn-action.like').forEach(button => {
+            button.addEventListener('click', function (event) {
+                event.stopPropagation(); // Prevent card click event from firing
+
+                const photoId = this.dataset.photoId;
+                const currentLikesSpan = document.getElementById(`likes-${photoId}`);
+                const currentVoteStatus = this.dataset.currentVote; // 'up', 'down', or 'none'
+
+                // Clicking an active like removes it (sent as the opposite vote); otherwise it's an upvote
+                const voteTypeToSend = currentVoteStatus === 'up' ? 'none' : 'up';
+
+                postVote('post', photoId, voteTypeToSend === 'none' ? (currentVoteStatus === 'up' ? 'down' : 'up') : voteTypeToSend)
+                    .then(data => {
+                        if (data.success) {
+                            // Update UI based on server response
+                            currentLikesSpan.textContent = data.new_score;
+                            this.dataset.currentVote = data.user_vote_status; // Update data attribute for next click
+                            this.classList.toggle('active', data.user_vote_status === 'up');
+                        } else {
+                            alert('Error updating like: ' + data.message);
+                            console.error('Vote failed:', data.message);
+                        }
+                    })
+                    .catch(error => {
+                        console.error('Error during fetch:', error);
+                        alert('An error occurred while trying to like the post.');
+                    });
+            });
+        });
+    }
+
+    function renderPhotoCard(photo) {
+        const { anonId, csrfToken } = pageContext();
+        const listView = document.getElementById('post-list').dataset.view === 'list';
+        const id = photo.id;
+        const media = photo.is_video
+            ? `<video controls class="img-fluid"><source src="${escapeHtml(photo.image_url)}" type="video/mp4">Your browser does not support the video tag.</video>`
+            : `<img src="${escapeHtml(photo.image_url)}" alt="${escapeHtml(photo.title || 'Anonymous Photo')}" class="img-fluid" />`;
+        const deleteForm = photo.original_poster_anon_id === anonId
+            ? `<form action="/delete_post/${id}" method="POST" style="display:inline;" onsubmit="return confirm('Are you sure you want to delete this photo?');" class="delete-form">
+                   <input type="hidden" name="csrf_token" value="${escapeHtml(csrfToken)}">
+                   <button type="submit" class="btn-action delete" title="Delete Photo" onclick="event.stopPropagation();"><i class="fas fa-trash-alt"></i></button>
+               </form>`
+            : '';
+        const card = document.createElement('div');
+        card.className = `photo-card ${listView ? 'list-view' : ''}`;
+        card.dataset.photoId = id;
+        card.addEventListener('click', () => { window.location.href = `/post/${id}`; });
+        card.innerHTML = `
+            ${media}
+            <div class="photo-info">
+                ${photo.title ? `<div class="photo-title">${escapeHtml(photo.title)}</div>` : ''}
+                <div class="photo-meta">
+                    <span>Anon${escapeHtml(anonName(photo.original_poster_anon_id))}</span>
+                    <span> • ${escapeHtml(photo.created)}</span>
+                </div>
+                <div class="photo-actions">
+                    <button type="button" class="btn-action like ${photo.user_vote === 'up' ? 'active' : ''}" data-photo-id="${id}" data-current-vote="${photo.user_vote || 'none'}" onclick="event.stopPropagation();">
+                        <i class="fas fa-heart"></i> Likes (<span id="likes-${id}">${photo.sigma}</span>)
+                    </button>
+                    <a href="/post/${id}" class="btn-action comment-link" onclick="event.stopPropagation();"><i class="fas fa-comment"></i> Comments (${photo.total_comments})</a>
+                    ${deleteForm}
+                </div>
+            </div>`;
+        return card;
+    }
+
+    AnonBoard.initPhotosPage = function () {
+        const enhance = root => {
+            renderSimpleMarkdown(root, '.photo-title-rendered, .photo-description-rendered, .comment-content-rendered');
+            bindPhotoLikeButtons(root);
+        };
+        initThemeToggle();
+        enhance(document);
+        initInfiniteScroll('photos', renderPhotoCard, enhance);
+        initSearch('latest', 'grid');
+    };
+
+    // --- Thread discussions page ---
+    function bindThreadCards(root) {
+        // AJAX for upvote/downvote
+        root.querySelectorAll('.vote-btn').forEach(button => {
+            button.addEventListener('click', function (event) {
+                event.preventDefault(); // Prevent default button action (form submission)
+                event.stopPropagation(); // Prevent click from bubbling up to the card
+
+                const postId = parseInt(this.dataset.postId, 10);
+                const voteType = this.dataset.voteType; // 'up' or 'down'
+
+                if (isNaN(postId) || !voteType) {
+                    console.error('Missing or invalid postId or voteType on the button:', this);
+                    alert('Error: Could not determine post ID or vote type correctly. Please refresh.');
+                    return;
+                }
+
+                postVote('post', postId, voteType)
+                    .then(data => {
+                        if (data.success) {
+                            const scoreSpan = document.getElementById(`score-${postId}`);
+                            if (scoreSpan) {
+                                scoreSpan.textContent = data.new_score;
+
+                                const currentUpvoteBtn = this.closest('.vote-button-group').querySelector('.upvote');
+                                const currentDownvoteBtn = this.closest('.vote-button-group').querySelector('.downvote');
+
+                                currentUpvoteBtn.classList.toggle('active', data.user_vote_status === 'up');
+                                currentDownvoteBtn.classList.toggle('active', data.user_vote_status === 'down');
+                            }
+                        } else {
+                            console.error('Voting failed (server reported failure):', data.message);
+                            alert('Could not cast vote: ' + data.message);
+                        }
+                    })
+                    .catch(error => {
+                        console.error('Fetch error during vote:', error);
+                        alert('An error occurred while voting: ' + (error.message || 'Unknown error'));
+                    });
+            });
+        });
+
+        // Card clicks navigate to post_detail, except on vote buttons, comment links and delete forms
+        root.querySelectorAll('.post-card').forEach(card => {
+            card.addEventListener('click', function (event) {
+                if (event.target.closest('.vote-btn') || event.target.closest('.comment-link') || event.target.closest('.delete-form')) {
+                    return;
+                }
+                const postId = this.dataset.postId;
+                if (postId) {
+                    window.location.href = `/post/${postId}`;
+                }
+            });
+        });
+
+        root.querySelectorAll('.delete-form').forEach(form => {
+            form.addEventListener('click', event => event.stopPropagation());
+        });
+    }
+
+    function renderThreadCard(post) {
+        const { anonId, csrfToken } = pageContext();
+        const compactView = document.getElementById('post-list').dataset.view === 'compact';
+        const id = post.id;
+        const comments = post.latest_comments || [];
+        const commentsHtml = comments.length
+            ? `<h6 class="mt-3">💬 Latest Comments</h6>` + comments.map(comment => `
+                <div class="comment-box">
+                    <strong>anon${escapeHtml(anonName(comment.commenter_anon_id))}:</strong>
+                    <span class="comment-content-rendered" data-markdown-content="${escapeHtml(comment.content)}"></span>
+                    <span class="text-muted small ms-2">${escapeHtml(comment.created_ago)}</span>
+                </div>`).join('')
+            : `<p class="text-muted small mt-3">No comments yet.</p>`;
+        const viewAll = post.total_comments > 2
+            ? `<div class="text-end mt-2"><a href="/post/${id}" class="btn btn-sm btn-link text-decoration-none comment-link">View All ${post.total_comments} Comments <i class="fas fa-chevron-right"></i></a></div>`
+            : '';
+        const deleteForm = post.original_poster_anon_id === anonId
+            ? `<form action="/delete_post/${id}" method="POST" style="display:inline; margin-left: auto;" onsubmit="return confirm('Are you sure you want to delete this post?');" class="delete-form">
+                   <input type="hidden" name="csrf_token" value="${escapeHtml(csrfToken)}">
+                   <button type="submit" class="btn btn-sm btn-outline-danger" title="Delete Post"><i class="fas fa-trash-alt"></i></button>
+               </form>`
+            : '';
+        const card = document.createElement('div');
+        card.className = `post-card ${compactView ? 'compact-view' : ''}`;
+        card.dataset.postId = id;
+        card.innerHTML = `
+            <div class="vote-controls">
+                <div class="vote-button-group">
+                    <button type="button" class="vote-btn upvote ${post.user_vote === 'up' ? 'active' : ''}" data-post-id="${id}" data-vote-type="up"><i class="fas fa-arrow-up"></i></button>
+                    <span class="sigma-score" id="score-${id}">${post.sigma}</span>
+                    <button type="button" class="vote-btn downvote ${post.user_vote === 'down' ? 'active' : ''}" data-post-id="${id}" data-vote-type="down"><i class="fas fa-arrow-down"></i></button>
+                </div>
+            </div>
+            <div class="post-content-container">
+                <div class="post-header">
+                    ${post.title ? `<h2 class="post-title-rendered mt-2" data-markdown-content="${escapeHtml(post.title)}"></h2>` : ''}
+                    ${post.content ? `<p class="post-body-rendered" data-markdown-content="${escapeHtml(post.content)}"></p>` : ''}
+                    <div class="post-meta-line">
+                        <strong class="post-username">Anon${escapeHtml(anonName(post.original_poster_anon_id))}</strong>
+                        <span class="text-muted small"> • ${escapeHtml(post.created_ago)}</span>
+                    </div>
+                    <div class="post-actions d-flex justify-content-end align-items-center mt-2">
+                        <a href="/post/${id}" class="btn btn-sm btn-outline-secondary ms-2 comment-link"><i class="fas fa-comment"></i> Comments (${post.total_comments})</a>
+                        ${deleteForm}
+                    </div>
+                </div>
+                <div class="comment-section">${commentsHtml}${viewAll}</div>
+            </div>`;
+        return card;
+    }
+
+    function initSearchTag() {
+        const mainSearchInput = document.getElementById('mainSearchInput');
+        const searchInputContainer = document.querySelector('.search-input-container');
+        const searchQuery = new URLSearchParams(window.location.search).get('q');
+        if (!searchQuery || !mainSearchInput || !searchInputContainer) return;
+
+        const searchTag = document.createElement('span');
+        searchTag.classList.add('search-tag');
+        searchTag.innerHTML = `
+            <img src="https://img.icons8.com/color/16/000000/reddit--v1.png" alt="AnonBoard Icon" style="height: 16px; width: 16px;">
+            ${escapeHtml(searchQuery)}
+            <i class="fas fa-times remove-tag" style="margin-left: 5px;"></i>
+        `;
+        searchInputContainer.prepend(searchTag);
+        mainSearchInput.placeholder = '';
+        mainSearchInput.style.width = 'fit-content';
+        mainSearchInput.style.flexGrow = '0';
+
+        searchTag.querySelector('.remove-tag').addEventListener('click', () => {
+            const currentUrl = new URL(window.location.href);
+            currentUrl.searchParams.delete('q');
+            window.location.href = currentUrl.toString();
+        });
+    }
+
+    function subscribeToSigmaUpdates() {
+        const socket = io(); // Connects to the SocketIO server
+        const currentAnonId = pageContext().anonId;
+
+        // Only the current user's profile score is updated from 'update_sigma'
+        socket.on('update_sigma', function (data) {
+            if (data.anon_id == currentAnonId) {
+                const sigmaScoreElement = document.getElementById('user-sigma-score');
+                const sigmaScoreElementRightPanel = document.getElementById('user-sigma-score-right-panel');
+                if (sigmaScoreElement) {
+                    sigmaScoreElement.textContent = `Sigma: ${data.new_sigma}`;
+                }
+                if (sigmaScoreElementRightPanel) {
+                    sigmaScoreElementRightPanel.textContent = data.new_sigma;
+                }
+            }
+        });
+
+        socket.on('update_post_sigma', function (data) {
+            const scoreSpan = document.getElementById(`score-${data.post_id}`);
+            if (scoreSpan) {
+                scoreSpan.textContent = data.new_sigma;
+            }
+        });
+        return socket;
+    }
+
+    AnonBoard.initTextPage = function () {
+        marked.setOptions({
+            sanitize: true,
+            gfm: true
+        });
+        const enhance = root => {
+            renderMarkedMarkdown(root);
+            bindThreadCards(root);
+        };
+        subscribeToSigmaUpdates();
+        initThemeToggle();
+        enhance(document);
+        initInfiniteScroll('threads', renderThreadCard, enhance);
+        initSearch('best', 'card');
+        initSearchTag();
+    };
+
+    // --- Leaderboard page ---
+    function renderLeaderboardEntry(entry, currentAnonId) {
+        const item = document.createElement('li');
+        item.className = 'list-group-item post-card d-flex justify-content-between align-items-center';
+        if (String(entry.anon_id) === String(currentAnonId)) item.classList.add('border-primary');
+        item.innerHTML = `
+            <span><strong>#${entry.rank}</strong> Anon${escapeHtml(anonName(entry.anon_id))}</span>
+            <span class="sigma-score">${entry.score}</span>`;
+        return item;
+    }
+
+    AnonBoard.initLeaderboardPage = function () {
+        initThemeToggle();
+        const list = document.getElementById('leaderboard-list');
+        const socket = subscribeToSigmaUpdates();
+        // Rooms are left on disconnect, so join again after every (re)connect
+        socket.on('connect', () => socket.emit('join_leaderboard', { period: list.dataset.period }));
+        // The server pushes the whole top list of a period whenever its ranks or scores change
+        socket.on('leaderboard_update', function (data) {
+            if (data.period !== list.dataset.period) return;
+            const currentAnonId = pageContext().anonId;
+            list.replaceChildren(...data.entries.map(entry => renderLeaderboardEntry(entry, currentAnonId)));
+        });
+    };
+
+    AnonBoard.escapeHtml = escapeHtml;
+    AnonBoard.anonName = anonName;
+    AnonBoard.pageContext = pageContext;
+    AnonBoard.initThemeToggle = initThemeToggle;
+    AnonBoard.renderMarkdownText = renderMarkdownText;
+    AnonBoard.postVote = postVote;
+    AnonBoard.subscribeToSigmaUpdates = subscribeToSigmaUpdates;
+    window.AnonBoard = AnonBoard;
+})();
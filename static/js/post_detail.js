@@ -0,0 +1,52 @@
+// Client code for post_detail.html: up/down vote arrows. Everything else lives in post_detail_common.js.
+PostDetail.init({
+    scoreId(itemType, itemId) {
+        return `${itemType}-sigma-${itemId}`;
+    },
+
+    // --- AJAX Voting (Post AND Comment) ---
+    bindScoreButtons(root) {
+        root.querySelectorAll('.vote-btn').forEach(button => {
+            button.addEventListener('click', function (event) {
+                event.preventDefault();
+
+                const itemType = this.dataset.postId ? 'post' : 'comment';
+                const itemId = this.dataset.postId || this.dataset.commentId;
+                const voteType = this.dataset.voteType; // 'up' or 'down'
+                if (!itemId || !voteType) {
+                    console.error('Invalid vote data:', { itemId, itemType, voteType });
+                    PostDetail.displayAjaxMessage('Error: Could not determine item to vote on.', 'danger');
+                    return;
+                }
+
+                PostDetail.castVote(itemType, itemId, voteType, data => {
+                    const sigmaSpan = document.getElementById(`${itemType}-sigma-${itemId}`);
+                    if (sigmaSpan) {
+                        sigmaSpan.textContent = data.new_score;
+                    }
+
+                    // Only the button matching the user's current vote stays active
+                    const upvoteBtn = document.querySelector(`.vote-btn.upvote[data-${itemType}-id="${itemId}"]`);
+                    const downvoteBtn = document.querySelector(`.vote-btn.downvote[data-${itemType}-id="${itemId}"]`);
+                    if (upvoteBtn) upvoteBtn.classList.toggle('active', data.user_vote_status === 'up');
+                    if (downvoteBtn) downvoteBtn.classList.toggle('active', data.user_vote_status === 'down');
+                });
+            });
+        });
+    },
+
+    renderScoreControls(comment) {
+        return `
+            <div class="vote-controls">
+                <button type="button" class="vote-btn upvote ${comment.user_vote === 'up' ? 'active' : ''}"
+                        data-comment-id="${comment.id}" data-vote-type="up">
+                    <i class="fas fa-arrow-up"></i>
+                </button>
+                <span class="sigma-score" id="comment-sigma-${comment.id}">${comment.sigma}</span>
+                <button type="button" class="vote-btn downvote ${comment.user_vote === 'down' ? 'active' : ''}"
+                        data-comment-id="${comment.id}" data-vote-type="down">
+                    <i class="fas fa-arrow-down"></i>
+                </button>
+            </div>`;
+    }
+});
@@ -0,0 +1,256 @@
+// Shared client code for the post pages (post_detail.html with vote arrows, post_detail_like.html with likes).
+// Builds on board.js; each page calls PostDetail.init() with what differs between the two:
+//   scoreId(itemType, itemId)        id of the element showing a post's or comment's score
+//   bindScoreButtons(root)           wires the vote or like buttons under root
+//   renderScoreControls(comment)     vote or like controls for a comment fetched from the API
+(function () {
+    'use strict';
+
+    const PostDetail = {};
+    const escapeHtml = AnonBoard.escapeHtml;
+
+    marked.setOptions({
+        breaks: true, // Render GFM line breaks (single newline means a <br>)
+        gfm: true, // Enable GitHub Flavored Markdown
+        sanitize: true // Sanitize the HTML output
+    });
+
+    // Displays a dismissible alert above the post for 5 seconds
+    function displayAjaxMessage(message, type) {
+        const ajaxMessagesDiv = document.getElementById('ajax-messages');
+        ajaxMessagesDiv.innerHTML = `
+            <div class="alert alert-${type} alert-dismissible fade show" role="alert">
+                ${escapeHtml(message)}
+                <button type="button" class="btn-close" data-bs-dismiss="alert" aria-label="Close"></button>
+            </div>
+        `;
+        setTimeout(() => {
+            const alertElement = ajaxMessagesDiv.querySelector('.alert');
+            if (alertElement) {
+                const bsAlert = bootstrap.Alert.getInstance(alertElement) || new bootstrap.Alert(alertElement);
+                bsAlert.close();
+            }
+        }, 5000);
+    }
+
+    // Sends a vote and hands the server's reply to onSuccess; failures are reported in the alert area
+    function castVote(itemType, itemId, voteType, onSuccess) {
+        AnonBoard.postVote(itemType, itemId, voteType)
+            .then(data => {
+                if (data.success) {
+                    onSuccess(data);
+                } else {
+                    console.error('Voting failed (server reported failure):', data.message);
+                    displayAjaxMessage('Could not cast vote: ' + data.message, 'warning');
+                }
+            })
+            .catch(error => {
+                console.error('Fetch error during vote:', error);
+                displayAjaxMessage('An error occurred while voting: ' + (error.message || 'Unknown error'), 'danger');
+            });
+    }
+
+    function subscribeToScoreUpdates(page) {
+        const socket = io(); // Connects to the SocketIO server, do this only once
+
+        // Only the current user's profile score is updated from 'update_sigma'
+        socket.on('update_sigma', function (data) {
+            if (data.anon_id == AnonBoard.pageContext().anonId) {
+                const sigmaScoreElement = document.getElementById('user-sigma-score');
+                if (sigmaScoreElement) {
+                    sigmaScoreElement.textContent = data.new_sigma;
+                }
+            }
+        });
+
+        socket.on('update_post_sigma', function (data) {
+            const scoreSpan = document.getElementById(page.scoreId('post', data.post_id));
+            if (scoreSpan) {
+                scoreSpan.textContent = data.new_sigma;
+            }
+        });
+
+        socket.on('update_comment_sigma', function (data) {
+            const scoreSpan = document.getElementById(page.scoreId('comment', data.comment_id));
+            if (scoreSpan) {
+                scoreSpan.textContent = data.new_sigma;
+            }
+        });
+    }
+
+    // --- Comment Threads: reply form and lazily loaded replies ---
+    function initCommentThreads(page) {
+        const commentList = document.getElementById('comment-list');
+        const replyForm = document.getElementById('reply-form'); // Absent on archived posts, which are read-only
+        if (!commentList) return;
+
+        function renderCommentActions(comment) {
+            const replyCount = comment.collapsed_replies;
+            const loadReplies = replyCount ? `
+                    <button type="button" class="btn btn-sm btn-link load-replies-btn" data-comment-id="${comment.id}">
+                        Show ${replyCount} ${replyCount === 1 ? 'reply' : 'replies'}
+                    </button>` : '';
+            const context = AnonBoard.pageContext();
+            const deleteForm = comment.commenter_anon_id === context.anonId ? `
+                    <form action="/delete_comment/${comment.id}" method="POST" style="display:inline;"
+                        onsubmit="return confirm('Are you sure you want to delete this comment?');">
+                        <input type="hidden" name="csrf_token" value="${escapeHtml(context.csrfToken)}">
+                        <button type="submit" class="btn btn-sm btn-outline-danger" title="Delete Comment">
+                            <i class="fas fa-trash-alt"></i> Delete
+                        </button>
+                    </form>` : '';
+            const reply = replyForm ? `
+                    <button type="button" class="btn btn-sm btn-outline-secondary reply-btn" data-comment-id="${comment.id}">
+                        <i class="fas fa-reply"></i> Reply
+                    </button>` : '';
+            return `
+                <div class="comment-actions">${reply}${loadReplies}${deleteForm}
+                </div>`;
+        }
+
+        function renderComment(comment) {
+            return `
+            <div class="comment-card" id="comment-${comment.id}" data-comment-id="${comment.id}" style="--depth: ${comment.depth};">
+                ${page.renderScoreControls(comment)}
+                <div class="comment-content-container">
+                    <p class="comment-username">Anon${escapeHtml(AnonBoard.anonName(comment.commenter_anon_id))}</p>
+                    <p class="comment-body-text">${escapeHtml(comment.content)}</p>
+                    <small class="comment-timestamp">Commented ${escapeHtml(comment.created_ago)}</small>${renderCommentActions(comment)}
+                </div>
+            </div>`;
+        }
+
+        function renderMoreReplies(commentId, cursor, depth) {
+            return `
+            <button type="button" class="btn btn-sm btn-link more-replies-btn" style="--depth: ${depth};"
+                    data-comment-id="${commentId}" data-cursor="${escapeHtml(cursor)}">
+                Show more replies
+            </button>`;
+        }
+
+        function showReplyForm(commentId) {
+            const card = document.getElementById(`comment-${commentId}`);
+            document.getElementById('reply_parent_id').value = commentId;
+            card.querySelector('.comment-content-container').appendChild(replyForm);
+            replyForm.classList.remove('d-none');
+            replyForm.querySelector('textarea').focus();
+        }
+
+        // Turns fetched comments (plus an optional "Show more replies" button) into nodes ready to insert
+        function buildComments(html) {
+            const template = document.createElement('template');
+            template.innerHTML = html;
+            template.content.querySelectorAll('.comment-card').forEach(card => {
+                AnonBoard.renderMarkdownText(card, '.comment-body-text');
+                page.bindScoreButtons(card);
+            });
+            return template.content;
+        }
+
+        function fetchComments(url) {
+            return fetch(url)
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.success) {
+                        throw new Error(data.message || 'Server error');
+                    }
+                    return data;
+                });
+        }
+
+        // Replies are fetched only when asked for. A collapsed branch goes right after its parent and the
+        // rest of a long thread replaces its "Show more replies" button, which is where they belong in thread order.
+        function loadReplies(button) {
+            const commentId = button.dataset.commentId;
+            const parentCard = document.getElementById(`comment-${commentId}`);
+            const depth = parseInt(parentCard.style.getPropertyValue('--depth') || '0') + 1;
+            const url = new URL(`/api/post/${commentList.dataset.postId}/comments/${commentId}/replies`, window.location.origin);
+            if (button.dataset.cursor) {
+                url.searchParams.set('cursor', button.dataset.cursor);
+            }
+            button.disabled = true;
+            fetchComments(url)
+                .then(data => {
+                    let html = data.comments.map(renderComment).join('');
+                    if (data.next_cursor) {
+                        html += renderMoreReplies(commentId, data.next_cursor, depth);
+                    }
+                    if (button.classList.contains('more-replies-btn')) {
+                        button.replaceWith(buildComments(html));
+                    } else {
+                        parentCard.after(buildComments(html));
+                        button.remove();
+                    }
+                })
+                .catch(error => {
+                    button.disabled = false;
+                    displayAjaxMessage('Could not load replies: ' + error.message, 'danger');
+                });
+        }
+
+        function loadMoreComments(button) {
+            const url = new URL(`/api/post/${commentList.dataset.postId}/comments`, window.location.origin);
+            url.searchParams.set('sort', commentList.dataset.sort);
+            url.searchParams.set('cursor', button.dataset.cursor);
+            button.disabled = true;
+            fetchComments(url)
+                .then(data => {
+                    const html = data.threads.map(thread => {
+                        const rest = thread.replies_cursor ? renderMoreReplies(thread.comments[0].id, thread.replies_cursor, 1) : '';
+                        return thread.comments.map(renderComment).join('') + rest;
+                    }).join('');
+                    commentList.appendChild(buildComments(html));
+                    if (data.next_cursor) {
+                        button.dataset.cursor = data.next_cursor;
+                        button.disabled = false;
+                    } else {
+                        button.remove();
+                    }
+                })
+                .catch(error => {
+                    button.disabled = false;
+                    displayAjaxMessage('Could not load comments: ' + error.message, 'danger');
+                });
+        }
+
+        commentList.addEventListener('click', function (event) {
+            const replyButton = event.target.closest('.reply-btn');
+            if (replyButton) {
+                showReplyForm(replyButton.dataset.commentId);
+                return;
+            }
+            const loadRepliesButton = event.target.closest('.load-replies-btn, .more-replies-btn');
+            if (loadRepliesButton) {
+                loadReplies(loadRepliesButton);
+            }
+        });
+        const loadMoreCommentsButton = document.getElementById('load-more-comments');
+        if (loadMoreCommentsButton) {
+            loadMoreCommentsButton.addEventListener('click', () => loadMoreComments(loadMoreCommentsButton));
+        }
+        if (replyForm) {
+            replyForm.querySelector('.reply-cancel-btn').addEventListener('click', () => {
+                replyForm.classList.add('d-none');
+            });
+        }
+    }
+
+    PostDetail.init = function (page) {
+        subscribeToScoreUpdates(page);
+        document.addEventListener('DOMContentLoaded', function () {
+            AnonBoard.initThemeToggle();
+            AnonBoard.renderMarkdownText(document, '.post-title, .post-body-text, .comment-body-text');
+            page.bindScoreButtons(document);
+
+            // Handle delete forms for comments without interfering with card clicks
+            document.querySelectorAll('.comment-actions form').forEach(form => {
+                form.addEventListener('click', event => event.stopPropagation());
+            });
+            initCommentThreads(page);
+        });
+    };
+
+    PostDetail.castVote = castVote;
+    PostDetail.displayAjaxMessage = displayAjaxMessage;
+    window.PostDetail = PostDetail;
+})();
@@ -0,0 +1,44 @@
+// Client code for post_detail_like.html: a single like button. Everything else lives in post_detail_common.js.
+PostDetail.init({
+    scoreId(itemType, itemId) {
+        return `${itemType}-likes-${itemId}`;
+    },
+
+    // --- AJAX Liking (Post AND Comment) ---
+    bindScoreButtons(root) {
+        root.querySelectorAll('.like-btn').forEach(button => {
+            button.addEventListener('click', function (event) {
+                event.preventDefault();
+
+                const itemId = this.dataset.itemId;
+                const itemType = this.dataset.itemType; // 'post' or 'comment'
+                if (!itemId || !itemType) {
+                    console.error('Missing item ID or type on the like button:', this);
+                    PostDetail.displayAjaxMessage('Error: Could not determine item to like/unlike.', 'danger');
+                    return;
+                }
+
+                // Clicking an active (liked) button is an unlike
+                const voteType = this.classList.contains('active') ? 'remove_upvote' : 'up';
+                PostDetail.castVote(itemType, itemId, voteType, data => {
+                    const likeCountSpan = document.getElementById(`${itemType}-likes-${itemId}`);
+                    if (likeCountSpan) {
+                        likeCountSpan.textContent = data.new_score;
+                    }
+                    this.classList.toggle('active', data.user_vote_status === 'up');
+                });
+            });
+        });
+    },
+
+    renderScoreControls(comment) {
+        return `
+            <div class="like-controls">
+                <button type="button" class="like-btn ${comment.user_vote === 'up' ? 'active' : ''}"
+                        data-item-id="${comment.id}" data-item-type="comment">
+                    <i class="fas fa-heart"></i>
+                </button>
+                <span class="like-count" id="comment-likes-${comment.id}">${comment.sigma}</span>
+            </div>`;
+    }
+});